@@ -0,0 +1,316 @@
+# Copyright 2016 Infinidat Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+try:
+    from collections import OrderedDict
+except ImportError:
+    from .collections import OrderedDict
+
+
+class LRUCache(object):
+    """A bounded, thread-safe mapping whose entries expire `ttl` seconds after they were set.
+    When the cache is full, the least recently used entry is evicted."""
+
+    def __init__(self, max_size, ttl, clock=time):
+        super(LRUCache, self).__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = Lock()
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at <= self._clock():
+                self.misses += 1
+                return default
+            self._items[key] = (value, expires_at)  # re-inserting moves the key to the most-recently-used end
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, self._clock() + self.ttl)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def discard(self, key, value):
+        """removes the entry of key if its value is value, e.g. an id that turned out to be stale.
+        :returns: True if the entry was removed"""
+        with self._lock:
+            if self._items.get(key, (None,))[0] != value:
+                return False
+            del self._items[key]
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get_stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self))
+
+
+class HostIndex(object):
+    """A thread-safe host name -> host id mapping of the hosts the driver manages.
+    It is loaded once from the system and kept up to date as hosts are created and deleted."""
+
+    def __init__(self):
+        super(HostIndex, self).__init__()
+        self._lock = Lock()
+        self._host_ids = {}
+
+    def load(self, host_ids):
+        with self._lock:
+            self._host_ids = dict(host_ids)
+
+    def get(self, name):
+        return self._host_ids.get(name)
+
+    def set(self, name, host_id):
+        with self._lock:
+            self._host_ids[name] = host_id
+
+    def pop(self, name):
+        with self._lock:
+            self._host_ids.pop(name, None)
+
+    def discard_id(self, host_id):
+        with self._lock:
+            for name in [name for name, value in self._host_ids.items() if value == host_id]:
+                del self._host_ids[name]
+
+    def __len__(self):
+        return len(self._host_ids)
+
+
+class LunIndex(object):
+    """A thread-safe (host id, volume id) -> lun mapping.
+    The mappings of a host are loaded with a single query on first use, and reloaded once they are `ttl` seconds old."""
+
+    def __init__(self, ttl, clock=time):
+        super(LunIndex, self).__init__()
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = Lock()
+        self._luns_by_host = {}
+        self._loaded_at = {}
+
+    def is_loaded(self, host_id):
+        loaded_at = self._loaded_at.get(host_id)
+        return loaded_at is not None and loaded_at + self.ttl > self._clock()
+
+    def load(self, host_id, luns):
+        """:param luns: an iterable of (volume id, lun) pairs"""
+        with self._lock:
+            self._luns_by_host[host_id] = dict(luns)
+            self._loaded_at[host_id] = self._clock()
+
+    def get(self, host_id, volume_id):
+        return self._luns_by_host.get(host_id, {}).get(volume_id)
+
+    def set(self, host_id, volume_id, lun):
+        with self._lock:
+            if host_id in self._luns_by_host:
+                self._luns_by_host[host_id][volume_id] = lun
+
+    def pop(self, host_id, volume_id):
+        with self._lock:
+            self._luns_by_host.get(host_id, {}).pop(volume_id, None)
+
+    def discard_volume(self, volume_id):
+        with self._lock:
+            for luns in self._luns_by_host.values():
+                luns.pop(volume_id, None)
+
+    def forget_host(self, host_id):
+        with self._lock:
+            self._luns_by_host.pop(host_id, None)
+            self._loaded_at.pop(host_id, None)
+
+
+class RefreshingCache(object):
+    """A thread-safe mapping from a key to a value computed by a fetch function.
+    The value is fetched on first use, and refresh() re-fetches all the known keys (e.g. from a PeriodicTask)"""
+
+    def __init__(self):
+        super(RefreshingCache, self).__init__()
+        self._lock = Lock()
+        self._values = {}
+        self._fetchers = {}
+
+    def get(self, key, fetch):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        value = fetch()
+        with self._lock:
+            self._values[key] = value
+            self._fetchers[key] = fetch
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+    def refresh(self):
+        """re-fetches every key. keys whose fetch fails are dropped, and the first failure is raised at the end"""
+        first_error = None
+        for key, fetch in list(self._fetchers.items()):
+            try:
+                value = fetch()
+            except Exception as error:
+                self.invalidate(key)
+                first_error = first_error or error
+            else:
+                with self._lock:
+                    self._values[key] = value
+        if first_error is not None:
+            raise first_error
+
+
+class SnapshotReuseWindow(object):
+    """A thread-safe source volume id -> snapshot mapping, for sharing one internal snapshot between all the clones of a
+    source that are requested within `window` seconds of each other.
+    Concurrent requests for the same source wait for the snapshot being created instead of creating their own.
+    The snapshots handed out are counted as in flight until their clone is created (see release), and a snapshot is
+    not deleted (see deletion) while any of its clones is in flight, as they are not its children on the system yet."""
+
+    def __init__(self, window, clock=time):
+        super(SnapshotReuseWindow, self).__init__()
+        self.window = window
+        self._clock = clock
+        self._lock = Lock()
+        self._source_locks = {}  # source id -> [lock, number of threads using it]
+        self._snapshots = {}  # source id -> (snapshot, created at)
+        self._in_flight = {}  # snapshot id -> number of clones being created from it
+        self._source_ids = {}  # snapshot id -> source id, of the snapshots in flight
+        self._deferred = set()  # ids of the snapshots whose deletion was skipped while they were in flight
+
+    @contextmanager
+    def _source_lock(self, source_id):
+        # the lock is removed when no thread uses it, so a thread never holds a lock that another one has replaced
+        with self._lock:
+            entry = self._source_locks.setdefault(source_id, [Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._source_locks[source_id]
+
+    def get_or_create(self, source_id, create):
+        """:returns: a (snapshot, created) tuple. create() is called if there's no snapshot of the source in the window.
+        the caller must call release() with the snapshot's id once its clone is created, or failed to"""
+        with self._lock:
+            self._expire()
+        with self._source_lock(source_id):
+            entry = self._snapshots.get(source_id)
+            if self.window > 0 and entry is not None and entry[1] + self.window > self._clock():
+                snapshot, created = entry[0], False
+            else:
+                snapshot, created = create(), True
+            with self._lock:
+                if created and self.window > 0:
+                    self._snapshots[source_id] = (snapshot, self._clock())
+                snapshot_id = snapshot.get_id()
+                self._in_flight[snapshot_id] = self._in_flight.get(snapshot_id, 0) + 1
+                self._source_ids[snapshot_id] = source_id
+            return snapshot, created
+
+    def release(self, snapshot_id):
+        """ends a clone creation started by get_or_create().
+        :returns: True if the snapshot's deletion was skipped meanwhile, and the caller should try it again"""
+        with self._lock:
+            count = self._in_flight[snapshot_id] - 1
+            if count:
+                self._in_flight[snapshot_id] = count
+                return False
+            del self._in_flight[snapshot_id]
+            del self._source_ids[snapshot_id]
+            if snapshot_id not in self._deferred:
+                return False
+            self._deferred.remove(snapshot_id)
+            return True
+
+    @contextmanager
+    def deletion(self, snapshot_id):
+        """removes the snapshot from the window, and yields whether it may be deleted, i.e. no clone of it is in flight.
+        the block runs under the lock of the snapshot's source, so no clone of it can start until it ends"""
+        with self._lock:
+            source_id = self._source_ids.get(snapshot_id)
+            if source_id is None:
+                source_id = next((source_id for source_id, (snapshot, _) in self._snapshots.items()
+                                  if snapshot.get_id() == snapshot_id), None)
+        if source_id is None:
+            # neither in the window nor in flight, so no clone of it can start
+            yield True
+            return
+        with self._source_lock(source_id):
+            with self._lock:
+                self._discard(snapshot_id)
+                in_flight = snapshot_id in self._in_flight
+                if in_flight:
+                    self._deferred.add(snapshot_id)
+            yield not in_flight
+
+    def pop(self, source_id):
+        with self._lock:
+            self._snapshots.pop(source_id, None)
+
+    def discard_snapshot(self, snapshot_id):
+        with self._lock:
+            self._discard(snapshot_id)
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def _discard(self, snapshot_id):
+        for source_id in [source_id for source_id, (snapshot, _) in self._snapshots.items()
+                          if snapshot.get_id() == snapshot_id]:
+            del self._snapshots[source_id]
+
+    def _expire(self):
+        now = self._clock()
+        for source_id in [source_id for source_id, (_, created_at) in self._snapshots.items()
+                          if created_at + self.window <= now]:
+            del self._snapshots[source_id]
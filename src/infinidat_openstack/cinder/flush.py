@@ -0,0 +1,93 @@
+# Copyright 2016 Infinidat Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import re
+from time import sleep, time
+
+SYSFS_ROOT = "/sys"
+MOUNTS_PATH = "/proc/mounts"
+DRAIN_POLL_INTERVAL = 0.05
+
+
+def get_block_device_name(device_path):
+    """returns the kernel name of a block device (e.g. sdc, dm-3), following symlinks such as /dev/disk/by-path"""
+    return os.path.basename(os.path.realpath(device_path))
+
+
+def get_inflight_count(device_name, sysfs_root=SYSFS_ROOT):
+    """returns the number of I/Os the device has in flight, from its sysfs inflight or stat file.
+    :raises IOError: if the kernel does not expose the device (or either file)"""
+    device_dir = os.path.join(sysfs_root, "class", "block", device_name)
+    try:
+        with open(os.path.join(device_dir, "inflight")) as fd:
+            return sum(int(value) for value in fd.read().split())  # "<reads> <writes>"
+    except IOError:
+        pass
+    with open(os.path.join(device_dir, "stat")) as fd:
+        return int(fd.read().split()[8])  # the ninth field is the number of I/Os currently in flight
+
+
+def wait_for_drain(device_name, timeout, sysfs_root=SYSFS_ROOT, interval=DRAIN_POLL_INTERVAL, clock=time, sleep=sleep):
+    """waits until the device has no I/O in flight, or until timeout seconds have passed.
+    :returns: a (drained, elapsed seconds) tuple
+    :raises IOError: if the in-flight count of the device cannot be read"""
+    start = clock()
+    while get_inflight_count(device_name, sysfs_root) > 0:
+        elapsed = clock() - start
+        if elapsed >= timeout:
+            return False, elapsed
+        sleep(min(interval, timeout - elapsed))
+    return True, clock() - start
+
+
+def get_partition_names(device_name, sysfs_root=SYSFS_ROOT):
+    device_dir = os.path.join(sysfs_root, "class", "block", device_name)
+    try:
+        names = os.listdir(device_dir)
+    except OSError:
+        return []
+    return [name for name in names if os.path.exists(os.path.join(device_dir, name, "partition"))]
+
+
+def _unescape_mount_field(value):
+    # /proc/mounts escapes spaces and other special characters as octal, e.g. \040
+    return re.sub(r"\\([0-7]{3})", lambda match: chr(int(match.group(1), 8)), value)
+
+
+def find_mount_point(device_name, mounts_path=MOUNTS_PATH, sysfs_root=SYSFS_ROOT):
+    """returns where the device, or one of its partitions, is mounted, or None if it is not mounted"""
+    names = set([device_name] + get_partition_names(device_name, sysfs_root))
+    with open(mounts_path) as fd:
+        for line in fd:
+            fields = line.split()
+            if len(fields) < 2 or not fields[0].startswith("/dev/"):
+                continue
+            if get_block_device_name(_unescape_mount_field(fields[0])) in names:
+                return _unescape_mount_field(fields[1])
+    return None
+
+
+def syncfs(path):
+    """flushes the filesystem mounted at path, and only it"""
+    from ctypes import CDLL, get_errno
+    libc = CDLL("libc.so.6", use_errno=True)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if libc.syncfs(fd) != 0:
+            errno = get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+    finally:
+        os.close(fd)
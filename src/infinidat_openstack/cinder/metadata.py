@@ -0,0 +1,124 @@
+# Copyright 2016 Infinidat Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+from threading import Thread, Condition
+from time import sleep
+from .parallel import map_concurrently
+try:
+    from collections import OrderedDict
+except ImportError:
+    from .collections import OrderedDict
+
+LOG = getLogger(__name__)
+
+
+class MetadataQueue(object):
+    """Applies metadata writes on a background thread, so creating an object does not wait for its metadata.
+
+    The worker takes up to batch_size queued writes at a time and applies them concurrently. A write that fails is
+    queued again, up to max_retries times. Writes to the same object are merged while they wait in the queue"""
+
+    def __init__(self, apply, name, batch_size=50, max_workers=8, max_retries=5, retry_delay=5):
+        super(MetadataQueue, self).__init__()
+        self.apply = apply
+        self.name = name
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._pending = OrderedDict()  # object id -> [object, metadata, attempts]
+        self._in_flight = set()
+        self._condition = Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self, reconcile=None):
+        """starts the worker. reconcile, if given, is called by the worker before it applies any queued write"""
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, args=(reconcile,), name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def put(self, obj, metadata):
+        with self._condition:
+            entry = self._pending.get(obj.get_id())
+            if entry is None:
+                self._pending[obj.get_id()] = [obj, dict(metadata), 0]
+            else:
+                entry[1].update(metadata)
+            self._condition.notify_all()
+
+    def pop(self, object_id):
+        """removes the pending write of an object, e.g. before the object is deleted.
+        :returns: the metadata that was about to be written, or None"""
+        with self._condition:
+            while object_id in self._in_flight:
+                self._condition.wait()
+            entry = self._pending.pop(object_id, None)
+        return None if entry is None else entry[1]
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _take_batch(self):
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                object_id, entry = self._pending.popitem(last=False)
+                self._in_flight.add(object_id)
+                batch.append(entry)
+            return batch
+
+    def _apply_batch(self, batch):
+        results = map_concurrently(lambda entry: self.apply(entry[0], entry[1]), batch, self.max_workers)
+        failed = False
+        with self._condition:
+            for result in results:
+                obj, metadata, attempts = result.item
+                self._in_flight.discard(obj.get_id())
+                if result.succeeded:
+                    continue
+                failed = True
+                if attempts + 1 >= self.max_retries:
+                    LOG.error("giving up on writing metadata {0!r} to {1!r}".format(metadata, obj),
+                              exc_info=result.exc_info)
+                    continue
+                LOG.warn("failed to write metadata to {0!r}, will retry".format(obj), exc_info=result.exc_info)
+                entry = self._pending.setdefault(obj.get_id(), [obj, {}, attempts + 1])
+                entry[1] = dict(metadata, **entry[1])  # writes queued meanwhile win
+            self._condition.notify_all()
+        return failed
+
+    def _run(self, reconcile):
+        if reconcile is not None:
+            try:
+                reconcile()
+            except:
+                LOG.exception("metadata reconciliation failed")
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return  # stopped
+            if self._apply_batch(batch):
+                sleep(self.retry_delay)
@@ -0,0 +1,222 @@
+# Copyright 2016 Infinidat Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import re
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from logging import getLogger
+from threading import Lock, local
+from time import time
+
+LOG = getLogger(__name__)
+
+# upper bounds, in seconds, of the latency histogram buckets. the last bucket has no upper bound
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current = local()
+
+
+class Histogram(object):
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        super(Histogram, self).__init__()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """returns the upper bound of the bucket holding the given percentile (the maximum, for the last bucket)"""
+        if not self.count:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self):
+        return dict(count=self.count,
+                    mean=self.total / self.count if self.count else None,
+                    max=self.max,
+                    p50=self.percentile(50),
+                    p90=self.percentile(90),
+                    p99=self.percentile(99),
+                    buckets=dict(zip([str(bound) for bound in self.bounds] + ["inf"], self.counts)))
+
+
+class Operation(object):
+    def __init__(self, name, traced=False, request_id=None):
+        super(Operation, self).__init__()
+        self.name = name
+        self.request_id = request_id
+        self.rest_calls = 0
+        self.retries = 0  # incremented by the driver when it repeats a request, e.g. a lookup of a stale cached id
+        self.requests = [] if traced else None
+        self.start = time()
+        self.duration = None
+
+    def record_request(self, method, path, status, duration):
+        if self.requests is not None:
+            self.requests.append(dict(method=method, url=get_url_template(path), status=status,
+                                      duration=duration, retry=self.retries))
+
+    def to_trace(self):
+        return dict(operation=self.name, request_id=self.request_id, start=self.start, duration=self.duration,
+                    retries=self.retries, requests=list(self.requests or ()))
+
+
+class OperationMetrics(object):
+    """Thread-safe per-operation latency histograms, error counts and REST call counts.
+
+    With a trace buffer size, the REST requests of every operation are also traced, and the traces of the last
+    operations are kept. The trace of an operation that takes slow_threshold seconds or more is logged as JSON"""
+
+    def __init__(self, trace_buffer_size=0, slow_threshold=0, clock=time):
+        super(OperationMetrics, self).__init__()
+        self.slow_threshold = slow_threshold
+        self._clock = clock
+        self._lock = Lock()
+        self._operations = {}
+        self._traces = deque(maxlen=trace_buffer_size) if trace_buffer_size > 0 else None
+
+    @contextmanager
+    def measure(self, name, request_id=None):
+        """measures the operation run in the block. REST calls made on this thread meanwhile (see instrument_api)
+        are counted on the operation, and on the operations it is nested in"""
+        outer = get_current_operation()
+        operation = Operation(name, traced=self._traces is not None, request_id=request_id)
+        set_current_operation(operation)
+        start = self._clock()
+        failed = True
+        try:
+            yield operation
+            failed = False
+        finally:
+            set_current_operation(outer)
+            if outer is not None:
+                outer.rest_calls += operation.rest_calls
+            operation.duration = self._clock() - start
+            self.record(name, operation.duration, operation.rest_calls, failed)
+            if self._traces is not None:
+                self._add_trace(operation)
+
+    def _add_trace(self, operation):
+        trace = operation.to_trace()
+        with self._lock:
+            self._traces.append(trace)
+        if self.slow_threshold and operation.duration >= self.slow_threshold:
+            LOG.warning("slow operation {0} took {1:.3f}s: {2}".format(operation.name, operation.duration,
+                                                                       json.dumps(trace, sort_keys=True)))
+
+    def get_traces(self):
+        """returns the traces of the last operations, oldest first"""
+        with self._lock:
+            return list(self._traces or ())
+
+    def _get_operation_stats(self, name):
+        stats = self._operations.get(name)
+        if stats is None:
+            stats = self._operations[name] = dict(latency=Histogram(), errors=0, rest_calls=0, steps={})
+        return stats
+
+    def record(self, name, duration, rest_calls=0, failed=False):
+        with self._lock:
+            stats = self._get_operation_stats(name)
+            stats['latency'].observe(duration)
+            stats['rest_calls'] += rest_calls
+            if failed:
+                stats['errors'] += 1
+
+    def record_step(self, name, step, duration):
+        """records the latency of one step of an operation, e.g. the snapshot that a clone is created from"""
+        with self._lock:
+            steps = self._get_operation_stats(name)['steps']
+            if step not in steps:
+                steps[step] = Histogram()
+            steps[step].observe(duration)
+
+    def get_stats(self):
+        with self._lock:
+            return dict((name, dict(latency=stats['latency'].to_dict(),
+                                    errors=stats['errors'],
+                                    rest_calls=stats['rest_calls'],
+                                    steps=dict((step, histogram.to_dict())
+                                               for step, histogram in stats['steps'].items())))
+                        for name, stats in self._operations.items())
+
+    def dump(self, path):
+        with open(path, "w") as fd:
+            json.dump(self.get_stats(), fd, indent=4, sort_keys=True)
+
+
+def get_current_operation():
+    return getattr(_current, 'operation', None)
+
+
+def set_current_operation(operation):
+    """worker threads doing part of an operation use this to count their REST calls on it"""
+    _current.operation = operation
+
+
+def get_url_template(path):
+    """returns the path without its query and with the object ids replaced, e.g. volumes/{id}/metadata"""
+    path = str(path).split("?")[0]
+    return re.sub(r"(^|/)\d+(?=/|$)", r"\1{id}", path)
+
+
+def _get_status_code(response):
+    # infinisdk wraps the requests response
+    return getattr(getattr(response, 'response', response), 'status_code', None)
+
+
+def instrument_api(api):
+    """wraps api.request so every request is counted, and traced, on the operation running on the calling thread"""
+    if getattr(api, '_instrumented', False):
+        return
+    request = api.request
+
+    def instrumented_request(*args, **kwargs):
+        operation = get_current_operation()
+        if operation is None:
+            return request(*args, **kwargs)
+        operation.rest_calls += 1
+        if operation.requests is None:
+            return request(*args, **kwargs)
+        method = args[0] if args else kwargs.get('http_method')
+        path = args[1] if len(args) > 1 else kwargs.get('path')
+        start = time()
+        status = None
+        try:
+            response = request(*args, **kwargs)
+            status = _get_status_code(response)
+            return response
+        except Exception as error:
+            status = getattr(error, 'status_code', None)
+            raise
+        finally:
+            operation.record_request(method, path, status, time() - start)
+    api.request = instrumented_request
+    api._instrumented = True
@@ -0,0 +1,79 @@
+# Copyright 2016 Infinidat Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+# cinder-volume monkey-patches threading with eventlet, so inside cinder these threads are green threads
+
+import sys
+from threading import Thread
+from Queue import Queue, Empty
+
+
+class TaskResult(object):
+    def __init__(self, item):
+        super(TaskResult, self).__init__()
+        self.item = item
+        self.value = None
+        self.exc_info = None
+
+    @property
+    def succeeded(self):
+        return self.exc_info is None
+
+    def __repr__(self):
+        return "<TaskResult({0!r}, succeeded={1})>".format(self.item, self.succeeded)
+
+
+def _run(func, result):
+    try:
+        result.value = func(result.item)
+    except:
+        result.exc_info = sys.exc_info()
+
+
+def map_concurrently(func, items, max_workers):
+    """calls func(item) for every item, running at most max_workers calls at a time.
+    :returns: a list of TaskResult objects, in the order of items. exceptions are captured, not raised"""
+    results = [TaskResult(item) for item in items]
+    if max_workers <= 1 or len(results) <= 1:
+        for result in results:
+            _run(func, result)
+        return results
+
+    queue = Queue()
+    for result in results:
+        queue.put(result)
+
+    def worker():
+        while True:
+            try:
+                result = queue.get_nowait()
+            except Empty:
+                return
+            _run(func, result)
+
+    threads = [Thread(target=worker) for _ in range(min(max_workers, len(results)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def raise_first_error(results):
+    for result in results:
+        if not result.succeeded:
+            exc_type, exc_value, exc_traceback = result.exc_info
+            raise exc_type, exc_value, exc_traceback
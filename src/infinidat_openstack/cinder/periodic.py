@@ -0,0 +1,55 @@
+# Copyright 2016 Infinidat Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+from threading import Thread, Event
+
+LOG = getLogger(__name__)
+
+
+class PeriodicTask(object):
+    """Calls func every `interval` seconds on a daemon thread, until stop() is called.
+    Exceptions raised by func are logged and do not stop the task."""
+
+    def __init__(self, func, interval, name):
+        super(PeriodicTask, self).__init__()
+        self.func = func
+        self.interval = interval
+        self.name = name
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def is_running(self):
+        return self._thread is not None and not self._stopped.is_set()
+
+    def _run(self):
+        while True:
+            self._stopped.wait(self.interval)
+            if self._stopped.is_set():
+                return
+            try:
+                self.func()
+            except:
+                LOG.exception("periodic task {0} failed".format(self.name))
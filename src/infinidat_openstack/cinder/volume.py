@@ -40,9 +40,20 @@ from capacity import GiB
 from time import sleep, time
 from infi.pyutils.decorators import wraps
 from logbook.compat import LoggingHandler
+from threading import Lock
+from uuid import uuid4
+from random import choice
+from .cache import LRUCache, HostIndex, LunIndex, RefreshingCache, SnapshotReuseWindow
+from .parallel import map_concurrently, raise_first_error
+from .periodic import PeriodicTask
+from .metadata import MetadataQueue
+from .metrics import OperationMetrics, instrument_api, get_current_operation, set_current_operation
+from .flush import get_block_device_name, wait_for_drain, find_mount_point, syncfs
 
 LOG = logging.getLogger(__name__)
 LOGBOOK_HANDLER = LoggingHandler()
+_logbook_handler_lock = Lock()
+_host_facts = dict(values=None, expires_at=0)
 
 volume_opts = [
     cfg.StrOpt('infinidat_pool_id', help='id the pool from which volumes are allocated', default=None),
@@ -55,12 +66,23 @@ volume_opts = [
     cfg.StrOpt('infinidat_cgsnapshot_name_prefix', help='Cinder cgsnapshot name prefix in Infinibox',
                default='openstack-cgsnap'),
     cfg.StrOpt('infinidat_host_name_prefix', help='Cinder host name prefix in Infinibox', default='openstack-host'),
-    cfg.IntOpt('infinidat_sync_sleep_duration', help='number of seconds to sleep after sync (workaround for cinder bug #1352875)', default=10),
+    cfg.IntOpt('infinidat_sync_sleep_duration', help='maximal number of seconds to wait for the I/O of a detached device to drain after sync (workaround for cinder bug #1352875)', default=10),
+    cfg.BoolOpt('infinidat_allow_global_sync', help='call sync for the whole node when the caches of a detached device cannot be flushed otherwise', default=False),
     cfg.BoolOpt('infinidat_prefer_fc', help='Use wwpns from connector if supplied with iSCSI initiator', default=False),
     cfg.BoolOpt('infinidat_allow_pool_not_found', help='allow the driver initialization when the pool not found', default=False),
     cfg.BoolOpt('infinidat_purge_volume_on_deletion', help='allow the driver to purge a volume (delete mappings and snapshots if necessary)', default=False),
     cfg.StrOpt('infinidat_preferred_iscsi_network_space', help='Preferred network space for iSCSI connectivity', default=None),
     cfg.StrOpt('infinidat_preferred_iscsi_portal', help='Preferred ip:port for iSCSI connectivity', default=None),
+    cfg.IntOpt('infinidat_lookup_cache_size', help='number of volume and snapshot names to keep in the lookup cache (0 disables the cache)', default=1024),
+    cfg.IntOpt('infinidat_lookup_cache_ttl', help='number of seconds a lookup cache entry stays valid', default=300),
+    cfg.IntOpt('infinidat_max_concurrency', help='maximal number of concurrent InfiniBox requests in a single operation', default=8),
+    cfg.IntOpt('infinidat_capacity_poll_interval', help='number of seconds between background polls of the pool capacity (0 polls when cinder asks for stats)', default=30),
+    cfg.IntOpt('infinidat_topology_refresh_interval', help='number of seconds between refreshes of the cached FC and iSCSI target topology (0 disables the refresh)', default=60),
+    cfg.IntOpt('infinidat_clone_snapshot_reuse_window', help='number of seconds during which clones of the same source volume share one internal snapshot (0 creates a snapshot per clone)', default=0),
+    cfg.StrOpt('infinidat_stats_dump_path', help='a file to write the per-operation driver metrics to (as JSON) whenever the volume stats are updated', default=None),
+    cfg.IntOpt('infinidat_trace_buffer_size', help='number of recent operations whose REST requests are kept in memory (0 disables tracing)', default=100),
+    cfg.FloatOpt('infinidat_slow_operation_threshold', help='number of seconds after which an operation is logged with its REST request trace (0 disables the log)', default=30),
+    cfg.BoolOpt('infinidat_async_metadata', help='write the metadata of new volumes and snapshots in the background, and tag the ones left untagged on startup', default=False),
 ]
 
 # Since we no longer inherit from SanDriver we have to read those config values
@@ -89,6 +111,16 @@ SYSTEM_METADATA_VALUE = 'openstack'
 STATS_VENDOR = 'Infinidat'
 STATS_PROTOCOL = 'iSCSI/FC'  # Nothing is actually done with this field
 INFINIHOST_VERSION_FILE = "/opt/infinidat/host-power-tools/src/infi/vendata/powertools/__version__.py"
+HOST_FACTS_REFRESH_INTERVAL = 3600
+BULK_QUERY_SIZE = 100  # number of names or ids we put in a single query
+# the fields each read-modify operation needs, fetched in a single request
+VOLUME_DELETE_FIELDS = ('has_children', 'parent')
+SNAPSHOT_DELETE_FIELDS = ('has_children',)
+VOLUME_EXTEND_FIELDS = ('size',)
+CONNECTION_FIELDS = ('write_protected',)
+# the ways of flushing a detached device, in the order we try them
+FLUSH_PATHS = ('ioctl', 'syncfs', 'helper', 'sync')
+CLONE_SOURCE_FIELDS = ('size',)
 
 
 class InfiniboxException(exception.CinderException):
@@ -115,12 +147,73 @@ def _infinisdk_to_cinder_exceptions_context():
         raise InfiniSDKException(str(e))
 
 
-def _log_decorator(func):
+def _is_object_not_found(error):
+    from infinisdk.core.exceptions import ObjectNotFound, APICommandFailed
+    if isinstance(error, ObjectNotFound):
+        return True
+    return isinstance(error, APICommandFailed) and getattr(error, 'status_code', None) == 404
+
+
+def _is_not_mapped(error):
+    # unmapping a volume that has no lun on the host fails with a KeyError, and so does one whose cached id is stale
+    return isinstance(error, KeyError) or _is_object_not_found(error)
+
+
+def _chunks(items, size):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+class _StepTimer(object):
+    """collects the duration of each step of a multi-step operation, for logging, and records it in the metrics"""
+
+    def __init__(self, metrics, operation_name):
+        super(_StepTimer, self).__init__()
+        self.metrics = metrics
+        self.operation_name = operation_name
+        self.start = time()
+        self.timings = []
+
+    @contextmanager
+    def step(self, name):
+        start = time()
+        try:
+            yield
+        finally:
+            duration = time() - start
+            self.timings.append((name, duration))
+            self.metrics.record_step(self.operation_name, name, duration)
+
+    def __str__(self):
+        steps = ", ".join("{0}={1:.3f}s".format(name, duration) for name, duration in self.timings)
+        return "total={0:.3f}s ({1})".format(time() - self.start, steps)
+
+
+def _get_request_id():
+    try:
+        from oslo_context import context
+    except ImportError:
+        return None
+    current = context.get_current()
+    return getattr(current, 'request_id', None)
+
+
+def _count_retry():
+    operation = get_current_operation()
+    if operation is not None:
+        operation.retries += 1
+
+
+def _instrument(func):
+    # this wraps every driver operation, so it has to stay cheap: the log arguments are only formatted in debug level
+    name = func.__name__
+
     @wraps(func)
     def wrapper(self, *args, **kwargs):
-        LOG.info("--> {0}({1})".format(func.__name__, '...'))
-        return_value = func(self, *args, **kwargs)
-        LOG.info("<-- {0!r}".format(return_value))
+        LOG.debug("--> %s(...)", name)
+        with self._metrics.measure(name, request_id=_get_request_id()) as operation:
+            return_value = func(self, *args, **kwargs)
+        LOG.debug("<-- %s: %r (%d REST calls)", name, return_value, operation.rest_calls)
         return return_value
     return wrapper
 
@@ -130,14 +223,24 @@ def infinisdk_to_cinder_exceptions(f):
     def wrapper(*args, **kwargs):
         with _infinisdk_to_cinder_exceptions_context():
             return f(*args, **kwargs)
-    return _log_decorator(wrapper)
+    return _instrument(wrapper)
+
+
+def _push_logbook_handler():
+    # infinisdk logs with logbook. the handler forwards its records to logging, for all threads, so we push it once
+    if getattr(LOGBOOK_HANDLER, 'pushed', False):
+        return
+    with _logbook_handler_lock:
+        if not getattr(LOGBOOK_HANDLER, 'pushed', False):
+            LOGBOOK_HANDLER.push_application()
+            LOGBOOK_HANDLER.pushed = True
 
 
 def logbook_compat(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
-        with LOGBOOK_HANDLER:
-            return f(*args, **kwargs)
+        _push_logbook_handler()
+        return f(*args, **kwargs)
     return wrapper
 
 
@@ -170,6 +273,18 @@ def get_powertools_version():
         return '0'
 
 
+def get_host_facts():
+    """returns the hostname, platform and powertools version we write to the host metadata.
+    these almost never change, so they are looked up at most once every HOST_FACTS_REFRESH_INTERVAL seconds"""
+    now = time()
+    if _host_facts['values'] is None or _host_facts['expires_at'] <= now:
+        _host_facts['values'] = dict(hostname=get_os_hostname(),
+                                     platform=get_os_platform(),
+                                     powertools_version=get_powertools_version())
+        _host_facts['expires_at'] = now + HOST_FACTS_REFRESH_INTERVAL
+    return dict(_host_facts['values'])
+
+
 class InfiniboxVolumeDriver(driver.VolumeDriver):
     VERSION = __version__
 
@@ -179,8 +294,31 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
         self.configuration.append_config_values(san_opts)
         self.volume_backend_name = self.configuration.config_group
         self.system = None
+        self._session = None
         self.pool = None
         self.volume_stats = None
+        self._capacity = None
+        self._capacity_poller = PeriodicTask(self._poll_capacity,
+                                             self.configuration.infinidat_capacity_poll_interval,
+                                             "infinidat-capacity-{0}".format(self.volume_backend_name))
+        self._lookup_cache = LRUCache(self.configuration.infinidat_lookup_cache_size,
+                                      self.configuration.infinidat_lookup_cache_ttl)
+        # the following are per-system, do_setup replaces them with the ones shared by all backends of the system
+        self._host_index = HostIndex()
+        self._lun_index = LunIndex(self.configuration.infinidat_lookup_cache_ttl)
+        # host id -> the metadata we last wrote to it
+        self._host_metadata_cache = LRUCache(self.configuration.infinidat_lookup_cache_size,
+                                             self.configuration.infinidat_lookup_cache_ttl)
+        self._topology_cache = RefreshingCache()
+        self._topology_refresher = None
+        self._writable_child_supported = None  # known after we connect to the system
+        self._metrics = OperationMetrics(self.configuration.infinidat_trace_buffer_size,
+                                         self.configuration.infinidat_slow_operation_threshold)
+        self._flush_counts = dict.fromkeys(FLUSH_PATHS + ('failed',), 0)
+        self._clone_sources = SnapshotReuseWindow(self.configuration.infinidat_clone_snapshot_reuse_window)
+        self._metadata_queue = MetadataQueue(self._write_queued_metadata,
+                                             "infinidat-metadata-{0}".format(self.volume_backend_name),
+                                             max_workers=self.configuration.infinidat_max_concurrency)
 
     @logbook_compat
     @infinisdk_to_cinder_exceptions
@@ -195,13 +333,19 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
         if provision_type.upper() not in ('THICK', 'THIN'):
             raise exception.InvalidInput(reason=translate("infinidat_provision_type must be THICK or THIN"))
 
-        from infinisdk import InfiniBox
-        self.system = InfiniBox(self.configuration.san_ip,
-                                auth=(self.configuration.san_login,
-                                      unmask(self.configuration.san_password) if \
-                                      is_masked(self.configuration.san_password) else \
-                                      self.configuration.san_password))
-        self.system.login()
+        from infinidat_openstack.sessions import get_session
+        self._session = get_session(self.configuration.san_ip,
+                                    self.configuration.san_login,
+                                    unmask(self.configuration.san_password) if \
+                                    is_masked(self.configuration.san_password) else \
+                                    self.configuration.san_password)
+        self.system = self._session.system
+        instrument_api(self.system.api)
+        self._use_shared_caches()
+        self._topology_refresher.start()
+        self._capacity_poller.start()
+        if self.configuration.infinidat_async_metadata:
+            self._metadata_queue.start(reconcile=self._reconcile_metadata)
         try:
             self._get_pool()  # we want to search for the pool here so we fail if we can't find it.
         except (ObjectNotFound, exception.InvalidInput):
@@ -243,10 +387,12 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
     @logbook_compat
     @infinisdk_to_cinder_exceptions
     def create_volume(self, cinder_volume):
-        infinidat_volume = self.system.volumes.create(name=self._create_volume_name(cinder_volume),
+        name = self._create_volume_name(cinder_volume)
+        infinidat_volume = self.system.volumes.create(name=name,
                                                       size=cinder_volume.size * GiB,
                                                       pool=self._get_pool(),
                                                       provisioning=self._get_provisioning())
+        self._lookup_cache.set(name, infinidat_volume.get_id())
         if hasattr(cinder_volume, 'consistencygroup') and cinder_volume.consistencygroup:
             cinder_cg = cinder_volume.consistencygroup
             self._add_volume_to_cg(infinidat_volume, cinder_cg)
@@ -256,37 +402,122 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
             infinidat_volume,
             cinder_volume,
             cinder_cg=cinder_cg)
+        return self._get_model_update(cinder_volume, infinidat_volume)
 
     def _purge_infinidat_volume(self, infinidat_volume):
-        if infinidat_volume.is_mapped():
-            infinidat_volume.unmap()
-
-        for child in list(infinidat_volume.get_children()):
-            self._purge_infinidat_volume(child)
-
-        infinidat_volume.delete()
+        """deletes the volume with all its descendants (snapshots and clones), unmapping them first"""
+        levels = self._get_descendant_levels(infinidat_volume)
+        nodes = [node for level in levels for node in level]
+        LOG.info("purging volume {0} with {1} descendants".format(infinidat_volume.get_id(), len(nodes) - 1))
+        start = time()
+
+        def timed(action, func):
+            def wrapper(node):
+                node_start = time()
+                func(node)
+                LOG.debug("purge: {0} of volume {1} took {2:.3f}s".format(action, node.get_id(), time() - node_start))
+            return wrapper
+
+        def unmap(node):
+            node.unmap()
+            self._lun_index.discard_volume(node.get_id())
+
+        def delete(node):
+            # the descendants' names came with the query that found them. the root's name is popped by our caller,
+            # and may not be cached on the object (e.g. one from the lookup cache), so it is not read after deletion
+            name = None if node is infinidat_volume else node.get_field('name', from_cache=True)
+            self._metadata_queue.pop(node.get_id())
+            node.delete()
+            if name is not None:
+                self._lookup_cache.pop(name)
+
+        mapped_nodes = [node for node in nodes if node.get_field('mapped', from_cache=True)]
+        raise_first_error(self._map_concurrently(timed("unmap", unmap), mapped_nodes))
+        LOG.info("purge: unmapped {0} volumes".format(len(mapped_nodes)))
+        # a volume can only be deleted once its children are gone, so we go from the leaves up
+        for depth in reversed(range(len(levels))):
+            raise_first_error(self._map_concurrently(timed("delete", delete), levels[depth]))
+            LOG.info("purge: deleted {0} volumes at depth {1}".format(len(levels[depth]), depth))
+        LOG.info("purged volume {0} in {1:.3f}s".format(infinidat_volume.get_id(), time() - start))
+
+    def _get_descendant_levels(self, infinidat_volume):
+        """:returns: the volume's tree as a list of levels, the first being [infinidat_volume]"""
+        if not infinidat_volume.is_field_supported('family_id'):
+            return self._get_descendant_levels_by_parent(infinidat_volume)
+        # all the snapshots and clones of a volume share its family id, so one (paged) query returns the whole tree
+        volumes = self.system.volumes
+        children = {}
+        for volume in volumes.find(volumes.fields.family_id == infinidat_volume.get_field('family_id')):
+            children.setdefault(volume.get_field('parent', from_cache=True, raw_value=True), []).append(volume)
+        levels = [[infinidat_volume]]
+        while True:
+            level = [child for node in levels[-1] for child in children.get(node.get_id(), [])]
+            if not level:
+                return levels
+            levels.append(level)
+
+    def _get_descendant_levels_by_parent(self, infinidat_volume):
+        # systems without family ids can only filter on the parent field, which finds the children of the given
+        # volumes and not their descendants. so we fetch the tree one level (one parent-in-list query) at a time
+        volumes = self.system.volumes
+        levels = [[infinidat_volume]]
+        while True:
+            children = []
+            for chunk in _chunks(levels[-1], BULK_QUERY_SIZE):
+                children.extend(volumes.find(volumes.fields.parent.in_(chunk)))
+            if not children:
+                return levels
+            levels.append(children)
 
     @logbook_compat
     @infinisdk_to_cinder_exceptions
     def delete_volume(self, cinder_volume):
         from infinisdk.core.exceptions import ObjectNotFound
         try:
-            infinidat_volume = self._find_volume(cinder_volume)
+            infinidat_volume = self._find_volume(cinder_volume, fields=VOLUME_DELETE_FIELDS)
         except ObjectNotFound:
             LOG.info("delete_volume: volume {0!r} not found in InfiniBox, returning None".format(cinder_volume))
             return
-        metadata = infinidat_volume.get_all_metadata()
-
-        if infinidat_volume.has_children():
-            raise exception.VolumeIsBusy(volume_name=translate(infinidat_volume.get_name()))
-
-        delete_parent = metadata.get("delete_parent", "false").lower() == "true"
-        object_to_delete = infinidat_volume.get_parent() if delete_parent else infinidat_volume
-
-        if self.configuration.infinidat_purge_volume_on_deletion:
-            self._purge_infinidat_volume(object_to_delete)
+        self._delete_infinidat_volume(cinder_volume, infinidat_volume)
+
+    def _delete_infinidat_volume(self, cinder_volume, infinidat_volume):
+        purge = self.configuration.infinidat_purge_volume_on_deletion
+        # purging deletes the volume's snapshots and clones with it, so only a plain deletion needs it childless
+        if not purge and infinidat_volume.get_field('has_children', from_cache=True):
+            raise exception.VolumeIsBusy(volume_name=translate(self._create_volume_name(cinder_volume)))
+
+        # delete_parent is only ever set on clones, so volumes without a parent don't need the metadata request
+        parent_id = infinidat_volume.get_field('parent', from_cache=True, raw_value=True)
+        # metadata that is still queued is not on the system yet, and there's no point in writing it now
+        pending_metadata = self._metadata_queue.pop(infinidat_volume.get_id())
+        delete_parent = False
+        if parent_id:
+            metadata = pending_metadata or infinidat_volume.get_all_metadata()
+            delete_parent = metadata.get("delete_parent", "false").lower() == "true"
+
+        self._lookup_cache.pop(self._create_volume_name(cinder_volume))
+        if purge:
+            self._purge_infinidat_volume(infinidat_volume)
         else:
-            object_to_delete.delete()
+            infinidat_volume.delete()
+        if delete_parent:
+            self._delete_clone_source_if_unused(parent_id)
+
+    def _delete_clone_source_if_unused(self, snapshot_id):
+        # an internal snapshot may be shared by several clones, so its children on the system are its reference count.
+        # the clones we are creating from it are not its children yet, so the last of them tries the deletion again
+        with self._clone_sources.deletion(snapshot_id) as may_delete:
+            if not may_delete:
+                return
+            snapshot = self.system.volumes.get_by_id_lazy(snapshot_id)
+            try:
+                if snapshot.get_field('has_children', from_cache=False):
+                    return
+                snapshot.delete()
+            except Exception as error:
+                if not _is_object_not_found(error):
+                    raise
+                # the last two clones were deleted concurrently, and the other deletion removed the snapshot
 
     @logbook_compat
     @infinisdk_to_cinder_exceptions
@@ -298,21 +529,57 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
         self._assert_connector(connector)
         methods = dict(fc=self._initialize_connection__fc,
                        iscsi=self._initialize_connection__iscsi)
-        return self._handle_connection(methods, cinder_volume, connector)
+        try:
+            return self._handle_connection(methods, cinder_volume, connector)
+        except:
+            # the failure may be due to a target port that went offline, so we don't trust the topology anymore
+            self._topology_cache.invalidate()
+            raise
 
     def _get_or_create_lun(self, host, volume):
-        for logical_unit in host.get_luns():
-            if logical_unit.get_volume() == volume:
-                return logical_unit.get_lun()
-        return host.map_volume(volume).get_lun()
+        lun = self._find_lun(host, volume.get_id())
+        if lun is not None:
+            return lun
+        return self._map_volume(host, volume)
 
-    def _get_iscsi_network_space(self):
+    def _map_volume(self, host, volume, lun=None):
+        from infinisdk.core.exceptions import APICommandFailed
+        host_id, volume_id = host.get_id(), volume.get_id()
+        kwargs = dict() if lun is None else dict(lun=lun)
+        try:
+            lun = host.map_volume(volume, **kwargs).get_lun()
+        except APICommandFailed:
+            # the volume may have been mapped by another cinder-volume process since we loaded the host's mappings
+            self._lun_index.forget_host(host_id)
+            existing_lun = self._find_lun(host, volume_id)
+            # all the ports of a connector must see the volume as the same lun, so a different one is a failure too
+            if existing_lun is None or lun not in (None, existing_lun):
+                raise
+            return existing_lun
+        self._lun_index.set(host_id, volume_id, lun)
+        return lun
+
+    def _find_lun(self, host, volume_id):
+        host_id = host.get_id()
+        if not self._lun_index.is_loaded(host_id):
+            self._lun_index.load(host_id, [(logical_unit.get_volume().get_id(), logical_unit.get_lun())
+                                           for logical_unit in host.get_luns()])
+        return self._lun_index.get(host_id, volume_id)
+
+    def _unmap_volume(self, host, volume):
+        host.unmap_volume(volume)
+        self._lun_index.pop(host.get_id(), volume.get_id())
+
+    def _get_iscsi_network_spaces(self):
         from infinisdk.core.exceptions import ObjectNotFound
         preferred_network_space = self.configuration.infinidat_preferred_iscsi_network_space
         try:
             if preferred_network_space:
-                return self.system.network_spaces.get(service="ISCSI_SERVICE", name=preferred_network_space)
-            return self.system.network_spaces.choose(service="ISCSI_SERVICE")
+                return [self.system.network_spaces.get(service="ISCSI_SERVICE", name=preferred_network_space)]
+            network_spaces = list(self.system.network_spaces.find(service="ISCSI_SERVICE"))
+            if not network_spaces:
+                raise ObjectNotFound("no iSCSI network spaces")
+            return network_spaces
         except ObjectNotFound:
             if preferred_network_space:
                 msg = "Can't find iSCSI network space {}".format(preferred_network_space)
@@ -321,10 +588,30 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
             raise ISCSINetworkSpaceNotFoundException(msg)
 
 
-    def _get_iscsi_portal(self, iscsi_network_space):
+    def _fetch_iscsi_targets(self):
+        targets = []
+        for iscsi_network_space in self._get_iscsi_network_spaces():
+            properties = iscsi_network_space.get_properties()
+            targets.append(dict(iqn=properties.iscsi_iqn,
+                                port=properties.iscsi_tcp_port,
+                                ip_addresses=[interface.ip_address for interface in iscsi_network_space.get_ips()]))
+        return targets
+
+    def _get_iscsi_target(self):
+        # backends with different preferred network spaces may share the topology cache, so it is part of the key
+        key = ('iscsi', self.configuration.infinidat_preferred_iscsi_network_space)
+        # we cache all the network spaces and choose one for every attach, so the attaches are spread across them
+        return choice(self._topology_cache.get(key, self._fetch_iscsi_targets))
+
+    def _get_fc_target_addresses(self):
+        def fetch():
+            return [str(wwn) for wwn in self.system.components.fc_ports.get_online_target_addresses()]
+        return list(self._topology_cache.get(('fc',), fetch))
+
+    def _get_iscsi_portal(self, iscsi_target):
         preferred_portal = self.configuration.infinidat_preferred_iscsi_portal
-        port = iscsi_network_space.get_properties().iscsi_tcp_port
-        available_portals = ["{}:{}".format(interface.ip_address, port) for interface in iscsi_network_space.get_ips()]
+        port = iscsi_target['port']
+        available_portals = ["{}:{}".format(ip_address, port) for ip_address in iscsi_target['ip_addresses']]
         for portal in available_portals:
             if not preferred_portal or preferred_portal == portal:
                 return portal
@@ -333,30 +620,70 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
 
 
     def _initialize_connection__fc(self, cinder_volume, connector):
-        infinidat_volume = self._find_volume(cinder_volume)
-        for wwpn in connector[u'wwpns']:
-            host = self._find_or_create_host_by_port(wwpn)
-            self._set_host_metadata(host)
-            lun = self._get_or_create_lun(host, infinidat_volume)
-        access_mode = 'ro' if infinidat_volume.is_write_protected() else 'rw'
-        target_wwn = [str(wwn) for wwn in self.system.components.fc_ports.get_online_target_addresses()]
+        infinidat_volume = self._find_volume(cinder_volume, fields=CONNECTION_FIELDS)
+        lun = self._map_volume_to_fc_ports(infinidat_volume, connector[u'wwpns'])
+        access_mode = 'ro' if infinidat_volume.get_field('write_protected', from_cache=True) else 'rw'
+        target_wwn = self._get_fc_target_addresses()
 
         # See comments in cinder/volume/driver.py:FibreChannelDriver about the structure we need to return.
         return dict(driver_volume_type='fibre_channel',
                     data=dict(target_discovered=False, target_wwn=target_wwn, target_lun=lun, access_mode=access_mode))
 
+    def _map_volume_to_fc_ports(self, infinidat_volume, wwpns):
+        # every port is a separate host in InfiniBox. we prepare the hosts concurrently, take the lun from an existing
+        # mapping (or from the first new one) and map the rest of the hosts with the same lun.
+        # if any port fails, the mappings we created are removed so the attach fails as a whole
+        volume_id = infinidat_volume.get_id()
+
+        def prepare_host(host):
+            self._set_host_metadata(host)
+            return self._find_lun(host, volume_id)
+
+        def map_port(wwpn, lun=None):
+            # returns the host too, for the rollback
+            return self._call_on_host(wwpn, lambda host: (host, self._map_volume(host, infinidat_volume, lun)),
+                                      create=True)
+
+        results = self._map_concurrently(lambda wwpn: self._call_on_host(wwpn, prepare_host, create=True), wwpns)
+        raise_first_error(results)
+        existing_luns = [result.value for result in results if result.value is not None]
+        unmapped_ports = [result.item for result in results if result.value is None]
+        mapped_hosts = []
+        if existing_luns:
+            lun = existing_luns[0]
+        else:
+            first_host, lun = map_port(unmapped_ports.pop(0))
+            mapped_hosts.append(first_host)
+        results = self._map_concurrently(lambda wwpn: map_port(wwpn, lun), unmapped_ports)
+        mapped_hosts.extend(result.value[0] for result in results if result.succeeded)
+        if not all(result.succeeded for result in results):
+            self._rollback_fc_mappings(infinidat_volume, mapped_hosts)
+            raise_first_error(results)
+        return lun
+
+    def _rollback_fc_mappings(self, infinidat_volume, hosts):
+        def unmap(host):
+            self._unmap_volume(host, infinidat_volume)
+        for result in self._map_concurrently(unmap, hosts):
+            if not result.succeeded:
+                LOG.error("failed to roll back the mapping of volume {0} to host {1}".format(infinidat_volume.get_id(),
+                                                                                             result.item.get_id()),
+                          exc_info=result.exc_info)
+
     def _initialize_connection__iscsi(self, cinder_volume, connector):
         from infi.dtypes.iqn import IQN
-        infinidat_volume = self._find_volume(cinder_volume)
-        host = self._find_or_create_host_by_port(IQN(connector[u'initiator']))
-        self._set_host_metadata(host)
-        lun = self._get_or_create_lun(host, infinidat_volume)
-        access_mode = 'ro' if infinidat_volume.is_write_protected() else 'rw'
+        infinidat_volume = self._find_volume(cinder_volume, fields=CONNECTION_FIELDS)
+
+        def map_volume(host):
+            self._set_host_metadata(host)
+            return self._get_or_create_lun(host, infinidat_volume)
+        lun = self._call_on_host(IQN(connector[u'initiator']), map_volume, create=True)
+        access_mode = 'ro' if infinidat_volume.get_field('write_protected', from_cache=True) else 'rw'
 
 
-        iscsi_network_space = self._get_iscsi_network_space()
-        target_portal = self._get_iscsi_portal(iscsi_network_space)
-        target_iqn = iscsi_network_space.get_properties().iscsi_iqn
+        iscsi_target = self._get_iscsi_target()
+        target_portal = self._get_iscsi_portal(iscsi_target)
+        target_iqn = iscsi_target['iqn']
 
         return dict(driver_volume_type='iscsi',
                     data=dict(
@@ -387,51 +714,89 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
         return self._handle_connection(methods, cinder_volume, connector, force=force)
 
     def _terminate_connection__fc(self, cinder_volume, connector, force=False):
-        from infinisdk.core.exceptions import ObjectNotFound
         infinidat_volume = self._find_volume(cinder_volume)
-        for wwpn in connector[u'wwpns']:
-            try:
-                host = self._find_host_by_port(wwpn)
-            except ObjectNotFound:
-                continue
-            self._set_host_metadata(host)
-            host.unmap_volume(infinidat_volume)
-            LOG.info("Volume(name={0!r}, id={1}) unmapped from Host (name={2!r}, id={3}) successfully".format(
-                    infinidat_volume.get_name(), infinidat_volume.get_id(), host.get_name(), host.get_id()))
-            self._delete_host_if_unused(host)
+
+        def unmap_ports(infinidat_volume):
+            # every port is handled even if another one failed, then the first failure is raised
+            raise_first_error(self._map_concurrently(
+                lambda wwpn: self._unmap_volume_from_port(cinder_volume, infinidat_volume, wwpn), connector[u'wwpns']))
+        self._call_on_volume(self._create_volume_name(cinder_volume), infinidat_volume, unmap_ports,
+                             is_stale=_is_not_mapped)
 
     def _terminate_connection__iscsi(self, cinder_volume, connector, force=False):
         infinidat_volume = self._find_volume(cinder_volume)
+
+        def unmap(infinidat_volume):
+            self._unmap_volume_from_port(cinder_volume, infinidat_volume, connector[u'initiator'])
+        self._call_on_volume(self._create_volume_name(cinder_volume), infinidat_volume, unmap,
+                             is_stale=_is_not_mapped)
+
+    def _unmap_volume_from_port(self, cinder_volume, infinidat_volume, port):
+        from infinisdk.core.exceptions import ObjectNotFound
+
+        def unmap(host):
+            self._set_host_metadata(host)
+            self._unmap_volume(host, infinidat_volume)
+            return host
         try:
-            host = self._find_host_by_port(connector[u'initiator'])
+            host = self._call_on_host(port, unmap)
         except ObjectNotFound:
-            return
-        self._set_host_metadata(host)
-        metadata_before_unmap = host.get_all_metadata()
-        host.unmap_volume(infinidat_volume)
+            return  # there is no host for the port, so nothing is mapped to it
         LOG.info("Volume(name={0!r}, id={1}) unmapped from Host (name={2!r}, id={3}) successfully".format(
-                    infinidat_volume.get_name(), infinidat_volume.get_id(), host.get_name(), host.get_id()))
+                self._create_volume_name(cinder_volume), infinidat_volume.get_id(),
+                self._create_host_name_by_port(str(port)), host.get_id()))
         self._delete_host_if_unused(host)
 
     @logbook_compat
     @infinisdk_to_cinder_exceptions
     def create_volume_from_snapshot(self, cinder_volume, cinder_snapshot):
-        infinidat_snapshot = self._find_snapshot(cinder_snapshot)
-        if cinder_volume.size * GiB < infinidat_snapshot.get_size():
-            msg = "cannot shrink snapshot. original size={}, target size={}".format(infinidat_snapshot.get_size(), cinder_volume.size * GiB)
+        timer = _StepTimer(self._metrics, "create_volume_from_snapshot")
+        with timer.step("find_snapshot"):
+            infinidat_snapshot = self._find_snapshot(cinder_snapshot, fields=CLONE_SOURCE_FIELDS)
+        size = infinidat_snapshot.get_field('size', from_cache=True)
+        if cinder_volume.size * GiB < size:
+            msg = "cannot shrink snapshot. original size={}, target size={}".format(size, cinder_volume.size * GiB)
             raise exception.InvalidInput(reason=translate(msg))
-        infinidat_volume = infinidat_snapshot.create_child(name=self._create_volume_name(cinder_volume))
+        infinidat_volume = self._create_clone(infinidat_snapshot, cinder_volume, timer)
+        LOG.debug("create_volume_from_snapshot: {0}".format(timer))
+        return self._get_model_update(cinder_volume, infinidat_volume)
+
+    def _create_clone(self, parent, cinder_volume, timer, delete_parent=False):
+        """creates a writable child of parent for cinder_volume. the steps that do not depend on each other
+        (adding to the consistency group and setting the metadata) run concurrently"""
+        name = self._create_volume_name(cinder_volume)
+        with timer.step("create_child"):
+            infinidat_volume = self._create_writable_child(parent, name)
+        self._lookup_cache.set(name, infinidat_volume.get_id())
+        size = cinder_volume.size * GiB
+        if size != parent.get_field('size', from_cache=True):
+            with timer.step("update_size"):
+                infinidat_volume.update_size(size)
+        cinder_cg = getattr(cinder_volume, 'consistencygroup', None) or None
+        steps = [("set_metadata", lambda: self._set_volume_or_snapshot_metadata(infinidat_volume,
+                                                                               cinder_volume,
+                                                                               delete_parent=delete_parent,
+                                                                               cinder_cg=cinder_cg))]
+        if cinder_cg:
+            steps.append(("add_to_cg", lambda: self._add_volume_to_cg(infinidat_volume, cinder_cg)))
+
+        def run(step):
+            with timer.step(step[0]):
+                step[1]()
+        raise_first_error(self._map_concurrently(run, steps))
+        return infinidat_volume
+
+    def _supports_writable_children(self):
+        if self._writable_child_supported is None:
+            self._writable_child_supported = self.system.compat.has_writable_snapshots()
+        return self._writable_child_supported
+
+    def _create_writable_child(self, parent, name):
+        if self._supports_writable_children():
+            return parent.create_child(name=name, write_protected=False)
+        infinidat_volume = parent.create_child(name=name)
         infinidat_volume.disable_write_protection()
-        infinidat_volume.update_size(cinder_volume.size * GiB)
-        if hasattr(cinder_volume, 'consistencygroup') and cinder_volume.consistencygroup:
-            cinder_cg = cinder_volume.consistencygroup
-            self._add_volume_to_cg(infinidat_volume, cinder_cg)
-        else:
-            cinder_cg = None
-        self._set_volume_or_snapshot_metadata(
-            infinidat_volume,
-            cinder_volume,
-            cinder_cg=cinder_cg)
+        return infinidat_volume
 
     @logbook_compat
     @infinisdk_to_cinder_exceptions
@@ -439,38 +804,51 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
         if tgt_cinder_volume.size < src_cinder_volume.size:
             msg = "cannot shrink clone. original size={}, target size={}".format(src_cinder_volume.size, tgt_cinder_volume.size)
             raise exception.InvalidInput(reason=translate(msg))
-        src_infinidat_volume = self._find_volume(src_cinder_volume)
-        # We first create a snapshot and then a clone from that snapshot.
-        snapshot = src_infinidat_volume.create_snapshot(name=self._create_snapshot_name(src_cinder_volume) + "-internal")
-        self._set_obj_metadata(snapshot, {
-            "cinder_id": "",
-            "internal": "true"
-            })
+        timer = _StepTimer(self._metrics, "create_cloned_volume")
+        with timer.step("find_volume"):
+            src_infinidat_volume = self._find_volume(src_cinder_volume)
+
+        # We first create a snapshot (or reuse a recent one of the same source) and then a clone from that snapshot.
+        def create_snapshot(src_infinidat_volume):
+            # clones of the same source may be created concurrently, so the name has to be unique
+            name = "{0}-{1}-internal".format(self._create_snapshot_name(src_cinder_volume), uuid4().hex[:8])
+            with timer.step("create_snapshot"):
+                snapshot = src_infinidat_volume.create_snapshot(name=name)
+            with timer.step("set_snapshot_metadata"):
+                self._queue_obj_metadata(snapshot, {
+                    "cinder_id": "",
+                    "internal": "true"
+                    })
+            return snapshot
+        snapshot, created = self._call_on_volume(
+            self._create_volume_name(src_cinder_volume), src_infinidat_volume,
+            lambda volume: self._clone_sources.get_or_create(volume.get_id(), lambda: create_snapshot(volume)))
         # We now create a clone from the snapshot
-        tgt_infinidat_volume = snapshot.create_child(name=self._create_volume_name(tgt_cinder_volume))
-        tgt_infinidat_volume.disable_write_protection()
-        tgt_infinidat_volume.update_size(tgt_cinder_volume.size * GiB)
-        if hasattr(tgt_cinder_volume, "consistencygroup") and tgt_cinder_volume.consistencygroup:
-            cinder_cg = tgt_cinder_volume.consistencygroup
-            self._add_volume_to_cg(tgt_infinidat_volume, cinder_cg)
-        else:
-            cinder_cg = None
-        self._set_volume_or_snapshot_metadata(
-            tgt_infinidat_volume,
-            tgt_cinder_volume,
-            delete_parent=True,
-            cinder_cg=cinder_cg)
+        try:
+            tgt_infinidat_volume = self._create_clone(snapshot, tgt_cinder_volume, timer, delete_parent=True)
+        except:
+            if not created:
+                # a shared snapshot may have been deleted by another process, so the next clone takes a new one
+                self._clone_sources.discard_snapshot(snapshot.get_id())
+            raise
+        finally:
+            if self._clone_sources.release(snapshot.get_id()):
+                # another clone of the snapshot was deleted meanwhile, and left the snapshot's deletion to us
+                self._delete_clone_source_if_unused(snapshot.get_id())
+        LOG.debug("create_cloned_volume: {0}".format(timer))
+        return self._get_model_update(tgt_cinder_volume, tgt_infinidat_volume)
 
     @logbook_compat
     @infinisdk_to_cinder_exceptions
     def extend_volume(self, cinder_volume, new_size):
         LOG.info("InfiniboxVolumeDriver.extend_volume")
-        infinidat_volume = self._find_volume(cinder_volume)
+        infinidat_volume = self._find_volume(cinder_volume, fields=VOLUME_EXTEND_FIELDS)
         new_size_in_bytes = new_size * GiB
-        if infinidat_volume.get_size() != new_size_in_bytes:
-            if infinidat_volume.get_size() > new_size_in_bytes:
+        size = infinidat_volume.get_field('size', from_cache=True)
+        if size != new_size_in_bytes:
+            if size > new_size_in_bytes:
                 msg = "cannot shrink volume: new size must be greater or equal to current size. original size={}, new size={}"
-                raise exception.InvalidInput(reason=translate(msg.format(infinidat_volume.get_size(), new_size_in_bytes)))
+                raise exception.InvalidInput(reason=translate(msg.format(size, new_size_in_bytes)))
             infinidat_volume.update_size(new_size_in_bytes)
 
     @logbook_compat
@@ -481,16 +859,27 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
     @logbook_compat
     @infinisdk_to_cinder_exceptions
     def create_snapshot(self, cinder_snapshot):
+        volume_name = self._create_volume_name(cinder_snapshot.volume)
         infinidat_volume = self._find_volume(cinder_snapshot.volume)
-        infinidat_snapshot = infinidat_volume.create_snapshot(name=translate(self._create_snapshot_name(cinder_snapshot)))
+        name = self._create_snapshot_name(cinder_snapshot)
+        infinidat_snapshot = self._call_on_volume(volume_name, infinidat_volume,
+                                                  lambda volume: volume.create_snapshot(name=translate(name)))
+        self._lookup_cache.set(name, infinidat_snapshot.get_id())
         self._set_volume_or_snapshot_metadata(infinidat_snapshot, cinder_snapshot)
+        return self._get_model_update(cinder_snapshot, infinidat_snapshot)
 
     @logbook_compat
     @infinisdk_to_cinder_exceptions
     def delete_snapshot(self, cinder_snapshot):
-        infinidat_snapshot = self._find_snapshot(cinder_snapshot)
-        if infinidat_snapshot.has_children():
-            raise exception.SnapshotIsBusy(snapshot_name=translate(infinidat_snapshot.get_name()))
+        infinidat_snapshot = self._find_snapshot(cinder_snapshot, fields=SNAPSHOT_DELETE_FIELDS)
+        self._delete_infinidat_snapshot(cinder_snapshot, infinidat_snapshot)
+
+    def _delete_infinidat_snapshot(self, cinder_snapshot, infinidat_snapshot):
+        name = self._create_snapshot_name(cinder_snapshot)
+        if infinidat_snapshot.get_field('has_children', from_cache=True):
+            raise exception.SnapshotIsBusy(snapshot_name=translate(name))
+        self._lookup_cache.pop(name)
+        self._metadata_queue.pop(infinidat_snapshot.get_id())
         infinidat_snapshot.delete()
 
     @logbook_compat
@@ -520,23 +909,29 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
 
         # 'members' (volumes) is passed as a parameter in liberty and above but not on kilo
         if members is None:
-            memebers = self.db.volume_get_all_by_group(context, cinder_cg.id)
-        for cinder_volume in memebers:
-            self.delete_volume(cinder_volume)
-            cinder_volume.status = 'deleted'
-
-        return {'status': cinder_cg['status']}, memebers
+            members = self.db.volume_get_all_by_group(context, cinder_cg.id)
+        infinidat_volumes = self._resolve_volumes(members, self._create_volume_name)
+        results = self._delete_members(members, infinidat_volumes, self._create_volume_name,
+                                       self._delete_infinidat_volume)
+        status = cinder_cg['status'] if all(result.succeeded for result in results) else 'error_deleting'
+        return {'status': status}, members
 
     @logbook_compat
     @infinisdk_to_cinder_exceptions
     def update_consistencygroup(self, context, cinder_cg, add_volumes=None, remove_volumes=None):
         infinidat_cg = self._find_cg(cinder_cg)
+        add_volumes, remove_volumes = add_volumes or [], remove_volumes or []
+        infinidat_volumes = self._resolve_volumes(add_volumes + remove_volumes, self._create_volume_name)
+
+        def find_volume(cinder_volume):
+            # _find_volume raises the right error for volumes the bulk lookup did not find
+            return infinidat_volumes.get(self._create_volume_name(cinder_volume)) or self._find_volume(cinder_volume)
+
+        # membership changes of the same group are applied one at a time
         for vol in add_volumes:
-            infinidat_volume = self._find_volume(vol)
-            infinidat_cg.add_member(infinidat_volume)
+            infinidat_cg.add_member(find_volume(vol))
         for vol in remove_volumes:
-            infinidat_volume = self._find_volume(vol)
-            infinidat_cg.remove_member(infinidat_volume)
+            infinidat_cg.remove_member(find_volume(vol))
 
         return None, None, None
 
@@ -548,10 +943,29 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
         infinidat_cg = self._find_cg_by_id(cinder_cg_id)
         infinidat_cgsnap = infinidat_cg.create_snapshot(name=self._create_cgsnapshot_name(cgsnapshot))
         members = self.db.snapshot_get_all_for_cgsnapshot(context, cgsnapshot.id)
+        # the system names the snapgroup members, so we match them to the cinder snapshots by their parent volume
+        infinidat_volumes = self._find_volumes_by_name([self._create_volume_name_by_id(snapshot.volume_id)
+                                                        for snapshot in members])
+        infinidat_snapshots_by_parent_id = dict((infinidat_snapshot.get_field('parent', from_cache=True, raw_value=True),
+                                                 infinidat_snapshot)
+                                                for infinidat_snapshot in infinidat_cgsnap.get_members())
+
+        def rename(snapshot):
+            infinidat_volume = infinidat_volumes.get(self._create_volume_name_by_id(snapshot.volume_id))
+            if infinidat_volume is None:
+                LOG.warn("create_cgsnapshot: volume of {0!r} not found in InfiniBox".format(snapshot))
+                return
+            infinidat_snapshot = infinidat_snapshots_by_parent_id.get(infinidat_volume.get_id())
+            if infinidat_snapshot is None:
+                LOG.warn("create_cgsnapshot: {0!r} has no member in {1!r}".format(snapshot, infinidat_cgsnap))
+                return
+            new_name = self._create_snapshot_name(snapshot)
+            infinidat_snapshot.update_name(new_name)
+            self._lookup_cache.set(new_name, infinidat_snapshot.get_id())
+            self._set_volume_or_snapshot_metadata(infinidat_snapshot, snapshot)
+
+        raise_first_error(self._map_concurrently(rename, members))
         for snapshot in members:
-            for infinidat_snapshot in infinidat_cgsnap.get_members():
-                if snapshot.volume_id in infinidat_snapshot.get_parent().get_name():
-                    infinidat_snapshot.update_name(self._create_snapshot_name(snapshot))
             snapshot.status = 'available'
         self._set_cg_metadata(infinidat_cgsnap, cgsnapshot)
         return {'status': 'available'}, members
@@ -571,14 +985,30 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
         else:
             infinidat_cgsnapshot.delete()
 
-        for cinder_snapshot in members:
-            self.delete_snapshot(cinder_snapshot)
-            cinder_snapshot.status = 'deleted'
-
-        return {'status': cgsnapshot.status}, members
+        infinidat_snapshots = self._resolve_volumes(members, self._create_snapshot_name)
+        results = self._delete_members(members, infinidat_snapshots, self._create_snapshot_name,
+                                       self._delete_infinidat_snapshot)
+        status = cgsnapshot.status if all(result.succeeded for result in results) else 'error_deleting'
+        return {'status': status}, members
+
+    def _delete_members(self, cinder_objects, infinidat_objects_by_name, create_name, delete):
+        """deletes the members of a group concurrently. a failure to delete one member does not stop the others,
+        instead each member's status is set to 'deleted' or 'error_deleting'"""
+        def delete_member(cinder_object):
+            infinidat_object = infinidat_objects_by_name.get(create_name(cinder_object))
+            if infinidat_object is None:
+                LOG.info("{0!r} not found in InfiniBox, treating it as deleted".format(cinder_object))
+                return
+            delete(cinder_object, infinidat_object)
+
+        results = self._map_concurrently(delete_member, cinder_objects)
+        for result in results:
+            result.item.status = 'deleted' if result.succeeded else 'error_deleting'
+            if not result.succeeded:
+                LOG.error("failed to delete {0!r}".format(result.item), exc_info=result.exc_info)
+        return results
 
     def _update_volume_stats(self):
-        from infinisdk.core.exceptions import ObjectNotFound
         """Retrieve stats info from volume group."""
 
         data = {}
@@ -588,16 +1018,43 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
         data["storage_protocol"] = 'FC' if self.configuration.infinidat_prefer_fc else 'iSCSI'
         data["consistencygroup_support"] = 'True'
 
-        try:
-            data['total_capacity_gb'] = self._get_pool().get_physical_capacity() / GiB
-            data['free_capacity_gb'] = self._get_pool().get_free_physical_capacity() / GiB
-        except (ObjectNotFound, exception.InvalidInput):
-            data['total_capaceity_gb'] = 0
-            data['free_capacity_gb'] = 0
+        # the capacity is polled in the background, so we report the latest values we have and how old they are
+        if self._capacity is None or not self._capacity_poller.is_running():
+            self._poll_capacity()
+        capacity = self._capacity
+        data['total_capacity_gb'] = capacity['total_capacity_gb']
+        data['free_capacity_gb'] = capacity['free_capacity_gb']
+        data['infinidat_capacity_age'] = int(time() - capacity['updated_at'])
 
         data['reserved_percentage'] = 0
         data['QoS_support'] = False
+        data['infinidat_flush_counts'] = dict(self._flush_counts)
+        data['infinidat_operations'] = self._metrics.get_stats()
         self.volume_stats = data
+        self._dump_metrics()
+
+    def _dump_metrics(self):
+        path = self.configuration.infinidat_stats_dump_path
+        if not path:
+            return
+        try:
+            self._metrics.dump(path)
+        except (IOError, OSError):
+            LOG.exception("failed to write the driver metrics to {0!r}".format(path))
+
+    def _poll_capacity(self):
+        from infinisdk.core.exceptions import ObjectNotFound
+        capacity = dict(total_capacity_gb=0, free_capacity_gb=0)
+        try:
+            # a single query for the pool, both capacity fields are then read from the returned object
+            pools = list(self.system.pools.find(id=self._get_pool().get_id()))
+        except (ObjectNotFound, exception.InvalidInput):
+            pools = []
+        if pools:
+            capacity.update(total_capacity_gb=pools[0].get_field('physical_capacity', from_cache=True) / GiB,
+                            free_capacity_gb=pools[0].get_field('free_physical_capacity', from_cache=True) / GiB)
+        capacity['updated_at'] = time()
+        self._capacity = capacity
 
     def _get_pool(self):
         if not self.pool:
@@ -607,11 +1064,124 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
             self.pool = pools[0]
         return self.pool
 
-    def _find_volume(self, cinder_volume):
-        return self.system.volumes.get(name=self._create_volume_name(cinder_volume))
+    def _find_volume(self, cinder_volume, fields=()):
+        return self._find_volume_by_name(self._create_volume_name(cinder_volume), self._get_provider_id(cinder_volume),
+                                         fields)
+
+    def _find_snapshot(self, cinder_snapshot, fields=()):
+        return self._find_volume_by_name(self._create_snapshot_name(cinder_snapshot),
+                                         self._get_provider_id(cinder_snapshot), fields)
+
+    def _find_volume_by_name(self, name, provider_id=None, fields=()):
+        """:param fields: fields the caller is about to read. they are fetched along with the lookup (in the same
+        request where possible), so the caller can read them with get_field(..., from_cache=True)
+
+        without fields, an id from the lookup cache is returned as a lazy object, without any request. it is stale if
+        the volume was deleted behind our back, which shows where the volume is used, see _call_on_volume.
+        fields take a request anyway, so the cache would save nothing there and is not consulted"""
+        # volumes and snapshots share the same namespace in InfiniBox, so they also share the lookup cache
+        if not fields:
+            volume_id = self._lookup_cache.get(name)
+            if volume_id is not None:
+                return self.system.volumes.get_by_id_lazy(volume_id)
+        infinidat_volume = self._find_volume_by_provider_id(name, provider_id, fields)
+        if infinidat_volume is None:
+            # objects created by older versions of the driver have no provider id
+            infinidat_volume = self._get_volume_by_name(name, fields)
+        self._lookup_cache.set(name, infinidat_volume.get_id())
+        return infinidat_volume
+
+    def _call_on_volume(self, name, infinidat_volume, func, is_stale=None):
+        """returns func(infinidat_volume), for a volume that _find_volume_by_name returned without fields.
+        if it fails because the volume's cached id is stale (see is_stale, not-found by default), the cache entry is
+        dropped and func is called again on the volume found by name"""
+        try:
+            return func(infinidat_volume)
+        except Exception as error:
+            if not (is_stale or _is_object_not_found)(error):
+                raise
+            if not self._lookup_cache.discard(name, infinidat_volume.get_id()):
+                raise  # the id did not come from the cache, or another thread already looked the volume up again
+        LOG.debug("cached id {0} of {1!r} is stale, looking it up again".format(infinidat_volume.get_id(), name))
+        _count_retry()
+        infinidat_volume = self._get_volume_by_name(name)
+        self._lookup_cache.set(name, infinidat_volume.get_id())
+        return func(infinidat_volume)
+
+    def _get_volume_by_id(self, volume_id, name, fields=()):
+        """returns the volume with the id, with the fields fetched in the same request.
+        :returns: None if the id no longer belongs to the volume named name (it was deleted or renamed)"""
+        infinidat_volume = self.system.volumes.get_by_id_lazy(volume_id)
+        return infinidat_volume if self._fetch_if_named(infinidat_volume, name, fields) else None
+
+    def _fetch_if_named(self, infinidat_object, name, fields=()):
+        """fetches the name and the fields of an object we know by id. our caches may hand out ids of objects that
+        were deleted or renamed behind our back, so this checks the object still exists under the name we know"""
+        from infinisdk.core.exceptions import APICommandFailed
+        try:
+            infinidat_object.get_fields(['name'] + list(fields))
+        except APICommandFailed as error:
+            if not _is_object_not_found(error):
+                raise
+            return False
+        return infinidat_object.get_field('name', from_cache=True) == name
 
-    def _find_snapshot(self, cinder_snapshot):
-        return self.system.volumes.get(name=self._create_snapshot_name(cinder_snapshot))
+    def _get_volume_by_name(self, name, fields=()):
+        from infinisdk.core.exceptions import ObjectNotFound
+        if not fields:
+            return self.system.volumes.get(name=name)
+        for infinidat_volume in self.system.volumes.find(name=name).only_fields(['id', 'name'] + list(fields)):
+            return infinidat_volume
+        raise ObjectNotFound("volume {0!r} not found".format(name))
+
+    def _find_volume_by_provider_id(self, name, provider_id, fields=()):
+        if provider_id is None:
+            return None
+        # a single GET of volumes/<id>. the id is only trusted if it still belongs to our object, the volume may have
+        # been recreated meanwhile
+        return self._get_volume_by_id(provider_id, name, fields)
+
+    def _get_provider_id(self, cinder_object):
+        provider_id = getattr(cinder_object, 'provider_id', None) or getattr(cinder_object, 'provider_location', None)
+        try:
+            return int(provider_id)
+        except (TypeError, ValueError):
+            return None
+
+    def _get_model_update(self, cinder_object, infinidat_object):
+        # provider_id was added to cinder in liberty, older versions only have provider_location
+        key = 'provider_id' if hasattr(cinder_object, 'provider_id') else 'provider_location'
+        return {key: str(infinidat_object.get_id())}
+
+    def _resolve_volumes(self, cinder_objects, create_name):
+        """bulk version of _find_volume/_find_snapshot.
+        :returns: a dict from InfiniBox name to volume (or snapshot). objects that do not exist are left out"""
+        known_ids = {}
+        for cinder_object in cinder_objects:
+            known_ids[create_name(cinder_object)] = self._get_provider_id(cinder_object)
+        return self._find_volumes_by_name(list(known_ids), known_ids)
+
+    def _find_volumes_by_name(self, names, known_ids=None):
+        """looks up many volumes (or snapshots) with as few queries as possible: the ones whose id we already know
+        (from the lookup cache or from cinder) with id-in-list queries, and the rest with name-in-list queries.
+        :returns: a dict from name to InfiniBox volume. names that do not exist are left out"""
+        volumes = self.system.volumes
+        known_ids = dict((name, self._lookup_cache.get(name) or (known_ids or {}).get(name)) for name in names)
+        found = {}
+        ids = [volume_id for volume_id in known_ids.values() if volume_id is not None]
+        for chunk in _chunks(ids, BULK_QUERY_SIZE):
+            for infinidat_volume in volumes.find(volumes.fields.id.in_(chunk)):
+                name = infinidat_volume.get_field('name', from_cache=True)
+                if known_ids.get(name) == infinidat_volume.get_id():  # an id we know may now belong to another volume
+                    found[name] = infinidat_volume
+        for chunk in _chunks([missing for missing in names if missing not in found], BULK_QUERY_SIZE):
+            for infinidat_volume in volumes.find(volumes.fields.name.in_(chunk)):
+                found[infinidat_volume.get_field('name', from_cache=True)] = infinidat_volume
+        for name, infinidat_volume in found.items():
+            self._lookup_cache.set(name, infinidat_volume.get_id())
+        for name in set(names).difference(found):
+            self._lookup_cache.pop(name)  # the volume is gone, so a cached id of it is stale
+        return found
 
     def _find_cg(self, cinder_cg):
         return self.system.cons_groups.get(name=self._create_cg_name(cinder_cg))
@@ -633,17 +1203,105 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
         else:
             infinidat_cg.add_member(infinidat_volume)
 
+    def _use_shared_caches(self):
+        configuration = self.configuration
+        session = self._session
+        self._host_index = session.get_shared(('host_index', configuration.infinidat_host_name_prefix),
+                                              self._load_host_index)
+        self._lun_index = session.get_shared('lun_index', lambda: self._lun_index)
+        self._host_metadata_cache = session.get_shared('host_metadata_cache', lambda: self._host_metadata_cache)
+        self._topology_cache = session.get_shared('topology_cache', lambda: self._topology_cache)
+        self._topology_refresher = session.get_shared('topology_refresher', lambda: PeriodicTask(
+            self._topology_cache.refresh,
+            configuration.infinidat_topology_refresh_interval,
+            "infinidat-topology-{0}".format(configuration.san_ip)))
+
+    def _load_host_index(self):
+        # host names are derived from their port, so indexing the hosts by name gives us a port -> host index
+        prefix = "{0}-".format(self.configuration.infinidat_host_name_prefix)
+        host_ids = {}
+        for host in self.system.hosts.get_all():
+            name = host.get_field('name', from_cache=True)
+            if name.startswith(prefix):
+                host_ids[name] = host.get_id()
+        self._host_index.load(host_ids)
+        LOG.debug("loaded {0} hosts into the host index".format(len(host_ids)))
+        return self._host_index
+
+    def _get_indexed_host(self, name):
+        """:returns: the host the index has under the name, without a request, or None if it has none.
+        the host may have been deleted behind our back, see _call_on_host"""
+        host_id = self._host_index.get(name)
+        if host_id is None:
+            return None
+        return self.system.hosts.get_by_id_lazy(host_id)
+
+    def _call_on_host(self, port, func, create=False):
+        """returns func(host) for the host of the port, found (or created, if create) by name.
+        a host from the host index may have been deleted behind our back: if func fails with not-found on it, the host
+        is forgotten and func is called again on the host looked up on the system"""
+        name = self._create_host_name_by_port(str(port))
+        host = self._get_indexed_host(name)
+        if host is not None:
+            try:
+                return func(host)
+            except Exception as error:
+                if not _is_object_not_found(error):
+                    raise
+            LOG.debug("indexed id {0} of host {1!r} is stale, looking it up again".format(host.get_id(), name))
+            self._forget_host(host.get_id())
+            _count_retry()
+        find_host = self._find_or_create_host_by_port if create else self._find_host_by_port
+        return func(find_host(port))
+
+    def _forget_host(self, host_id):
+        """drops what we keep about a host that was deleted"""
+        self._host_index.discard_id(host_id)
+        self._lun_index.forget_host(host_id)
+        self._host_metadata_cache.pop(host_id)
+
     def _find_host_by_port(self, port):
-        return self.system.hosts.get(name=self._create_host_name_by_port(port))
+        name = self._create_host_name_by_port(str(port))
+        host = self._get_indexed_host(name)
+        if host is not None:
+            return host
+        # the host may have been created by another cinder-volume process
+        host = self.system.hosts.get(name=name)
+        self._host_index.set(name, host.get_id())
+        return host
 
     def _find_or_create_host_by_port(self, port):
+        from infinisdk.core.exceptions import APICommandFailed
         name = self._create_host_name_by_port(str(port))
-        host = self.system.hosts.safe_get(name=name)
-        if not host:
+        host = self._get_indexed_host(name)
+        if host is not None:
+            return host
+        try:
             host = self.system.hosts.create(name=name)
+        except APICommandFailed:
+            # another cinder-volume process may have created the host since we built the index
+            host = self.system.hosts.safe_get(name=name)
+            if host is None:
+                raise
+        else:
             host.add_port(port)
+            self._lun_index.load(host.get_id(), [])  # a new host has no mappings to look up
+        self._host_index.set(name, host.get_id())
         return host
 
+    def _map_concurrently(self, func, items):
+        # the worker threads have to record their REST calls on the calling thread's operation
+        operation = get_current_operation()
+
+        def call(item):
+            outer_operation = get_current_operation()
+            set_current_operation(operation)
+            try:
+                return func(item)
+            finally:
+                set_current_operation(outer_operation)
+        return map_concurrently(call, items, self.configuration.infinidat_max_concurrency)
+
     def _delete_host_if_unused(self, host):
         from infinisdk.core.exceptions import APICommandFailed
         try:
@@ -653,12 +1311,17 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
                 pass  # host still contains mappings
             else:
                 raise  # some other bad thing happened
+        else:
+            self._forget_host(host.get_id())
 
     def _get_provisioning(self):
         return self.configuration.infinidat_provision_type.upper()
 
     def _create_volume_name(self, cinder_volume):
-        return "{0}-{1}".format(self.configuration.infinidat_volume_name_prefix, cinder_volume.id)
+        return self._create_volume_name_by_id(cinder_volume.id)
+
+    def _create_volume_name_by_id(self, cinder_volume_id):
+        return "{0}-{1}".format(self.configuration.infinidat_volume_name_prefix, cinder_volume_id)
 
     def _create_snapshot_name(self, cinder_snapshot):
         return "{0}-{1}".format(self.configuration.infinidat_snapshot_name_prefix, cinder_snapshot.id)
@@ -683,7 +1346,7 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
             }
         if cinder_cg and cinder_cg.id:
             metadata["cinder_cg_id"] = cinder_cg.id
-        self._set_obj_metadata(infinidat_volume, metadata)
+        self._queue_obj_metadata(infinidat_volume, metadata)
 
     def _set_cg_metadata(self, infinidat_cg, cinder_cg):
         metadata = {
@@ -693,65 +1356,153 @@ class InfiniboxVolumeDriver(driver.VolumeDriver):
         self._set_obj_metadata(infinidat_cg, metadata)
 
     def _set_host_metadata(self, infinidat_host):
-        metadata = {
-            "hostname": get_os_hostname(),
-            "platform": get_os_platform(),
-            "powertools_version": get_powertools_version()
-            }
-        self._set_obj_metadata(infinidat_host, metadata)
+        metadata = get_host_facts()
+        host_id = infinidat_host.get_id()
+        if self._host_metadata_cache.get(host_id) == metadata:
+            return
+        self._set_obj_metadata(infinidat_host, dict(metadata))
+        self._host_metadata_cache.set(host_id, metadata)
 
     def _set_obj_metadata(self, obj, metadata):
         metadata["system"] = str(SYSTEM_METADATA_VALUE)
         metadata["driver_version"] = str(self.VERSION)
         obj.set_metadata_from_dict(metadata)
 
+    def _queue_obj_metadata(self, obj, metadata):
+        if self.configuration.infinidat_async_metadata:
+            self._metadata_queue.put(obj, metadata)
+        else:
+            self._set_obj_metadata(obj, metadata)
+
+    def _write_queued_metadata(self, obj, metadata):
+        try:
+            self._set_obj_metadata(obj, dict(metadata))
+        except Exception as error:
+            if not _is_object_not_found(error):
+                raise
+            LOG.debug("not writing metadata to {0!r}, it was deleted".format(obj))
+
+    def _reconcile_metadata(self):
+        """tags the volumes and snapshots of our pool that have no metadata, e.g. because the driver stopped before
+        their queued metadata was written"""
+        volumes = list(self.system.volumes.find(pool=self._get_pool()))
+        names = dict((volume.get_id(), volume.get_field('name', from_cache=True)) for volume in volumes)
+        prefixes = tuple(prefix + "-" for prefix in (self.configuration.infinidat_volume_name_prefix,
+                                                     self.configuration.infinidat_snapshot_name_prefix))
+        # the metadata of the whole system is read in pages, instead of one request per volume
+        tagged_ids = set(entry['object_id'] for entry in self.system.get_all_metadata()
+                         if entry['key'] == 'cinder_id')
+        candidates = [volume for volume in volumes
+                      if names[volume.get_id()].startswith(prefixes) and volume.get_id() not in tagged_ids]
+
+        def get_cinder_id(name):
+            return [name[len(prefix):] for prefix in prefixes if name.startswith(prefix)][0]
+
+        def reconcile(volume):
+            name = names[volume.get_id()]
+            if name.endswith("-internal"):
+                metadata = {"cinder_id": "", "internal": "true"}
+            else:
+                # clones are the only children of internal snapshots, and only clones have delete_parent set
+                parent_name = names.get(volume.get_field('parent', from_cache=True, raw_value=True), "")
+                metadata = {"cinder_id": get_cinder_id(name),
+                            "delete_parent": str(parent_name.endswith("-internal"))}
+            self._write_queued_metadata(volume, metadata)
+
+        results = self._map_concurrently(reconcile, candidates)
+        tagged = [result.item for result in results if result.succeeded]
+        LOG.info("metadata reconciliation: tagged {0} of {1} volumes and snapshots".format(len(tagged), len(candidates)))
+        raise_first_error(results)
+
     def _assert_connector(self, connector):
         if ((u'wwpns' not in connector or not connector[u'wwpns']) and
             (u'initiator' not in connector or not connector[u'initiator'])):
             LOG.warn("no WWPN or iSCSI initiator was provided in connector: {0!r}".format(connector))
             raise exception.Invalid(translate('No WWPN or iSCSI initiator was received'))
 
-    def _flush_caches_for_specific_device(self, attach_info):
+    def _flush_caches_for_specific_device(self, device_path):
         import os
         from fcntl import ioctl
-        LOG.info("attempting to flush caches for {0!r}".format(attach_info))
-        fd = os.open(attach_info['device']['path'], os.O_RDONLY)
+        LOG.info("attempting to flush caches for {0!r}".format(device_path))
+        fd = os.open(device_path, os.O_RDONLY)
         try:
             ioctl(fd, 4705)  # BLKFLSBUF
         finally:
             os.close(fd)
-        self._sleep_after_sync()
 
-    def _call_sync(self):
+    def _syncfs_mounted_device(self, device_path):
+        mount_point = find_mount_point(get_block_device_name(device_path))
+        if mount_point is None:
+            raise IOError("{0!r} is not mounted".format(device_path))
+        LOG.info("attempting to flush the filesystem of {0!r} mounted on {1!r}".format(device_path, mount_point))
+        syncfs(mount_point)
+
+    def _flush_with_helper(self, device_path):
+        # cinder runs this through rootwrap, whose volume filters allow blockdev
+        LOG.info("attempting to flush caches for {0!r} with blockdev".format(device_path))
+        self._execute('blockdev', '--flushbufs', device_path, run_as_root=True)
+
+    def _call_sync(self, device_path=None):
+        if not self.configuration.infinidat_allow_global_sync:
+            raise InfiniboxException("global sync is disabled (infinidat_allow_global_sync)")
         from ctypes import CDLL
         libc = CDLL("libc.so.6")
         libc.sync()
         libc.sync()
         libc.sync()
-        self._sleep_after_sync()
 
-    def _sleep_after_sync(self):
-        # the call returns before the cache is actually flushed to disk, so we wait a bit
-        sleep(self.configuration.infinidat_sync_sleep_duration)
+    def _wait_for_drain(self, device_path):
+        # the flush returns before the I/O actually reaches the disk, so we wait for the device's in-flight I/O to drain
+        timeout = self.configuration.infinidat_sync_sleep_duration
+        device_name = get_block_device_name(device_path) if device_path else None
+        if not device_name:
+            # _get_detached_device_path could not tell the device, so there is nothing to watch
+            LOG.debug("the detached device is unknown, sleeping {0} seconds".format(timeout))
+            sleep(timeout)
+            return
+        try:
+            drained, elapsed = wait_for_drain(device_name, timeout)
+        except (IOError, OSError):
+            LOG.debug("cannot tell when the I/O of {0!r} drains, sleeping {1} seconds instead".format(device_path, timeout))
+            sleep(timeout)
+            return
+        if drained:
+            LOG.info("I/O of {0} drained in {1:.3f}s".format(device_name, elapsed))
+        else:
+            LOG.warn("I/O of {0} did not drain within {1}s".format(device_name, timeout))
 
-    def _flush_caches_to_disk(self, *args, **kwargs):
-        # http://blogs.gnome.org/cneumair/2006/02/11/ioctl-fsync-how-to-flush-block-device-buffers
-        # http://stackoverflow.com/questions/9551838/how-to-purge-disk-i-o-caches-on-linux
+    def _get_detached_device_path(self, *args, **kwargs):
+        # commit b868ae707f9ecbe254101e21d9d7ffa0b05b17d1 changed the interface for _detach_volume
+        # we need the attach_info instance, so we use this hack
+        from .getcallargs import getcallargs  # new in Python-2.7, we bundled the function for Python-2.6
         try:
-            # commit b868ae707f9ecbe254101e21d9d7ffa0b05b17d1 changed the interface for _detach_volume
-            # we need the attach_info instance, so we use this hack
-            from .getcallargs import getcallargs  # new in Python-2.7, we bundled the function for Python-2.6
             attach_info = getcallargs(super(InfiniboxVolumeDriver, self)._detach_volume, *args, **kwargs)['attach_info']
-            self._flush_caches_for_specific_device(attach_info)
+            return attach_info['device']['path']
         except:
-            # this can fail,
-            # for example, when cinder-volume runs under user 'cinder' which does not have permissions to read /dev/sdX
-            # so in case this fails, we just call sync
-            LOG.debug("failed to flush cache for specific device, will just call sync instead")
+            LOG.debug("failed to get the device path of the detached volume")
+            return None
+
+    def _flush_caches_to_disk(self, *args, **kwargs):
+        # http://blogs.gnome.org/cneumair/2006/02/11/ioctl-fsync-how-to-flush-block-device-buffers
+        # http://stackoverflow.com/questions/9551838/how-to-purge-disk-i-o-caches-on-linux
+        device_path = self._get_detached_device_path(*args, **kwargs)
+        flushers = dict(ioctl=self._flush_caches_for_specific_device,
+                        syncfs=self._syncfs_mounted_device,
+                        helper=self._flush_with_helper,
+                        sync=self._call_sync)
+        for path in FLUSH_PATHS:
             try:
-                self._call_sync()
+                flushers[path](device_path)
             except:
-                LOG.exception("call to sync failed, caches are not flushed")
+                # the ioctl can fail, for example, when cinder-volume runs under user 'cinder' which does not have
+                # permissions to read /dev/sdX. so we try the next way, global sync being the last resort
+                LOG.debug("failed to flush caches of {0!r} with {1}".format(device_path, path), exc_info=True)
+                continue
+            self._flush_counts[path] += 1
+            self._wait_for_drain(device_path)
+            return
+        self._flush_counts['failed'] += 1
+        LOG.error("failed to flush caches of {0!r}, caches are not flushed".format(device_path))
 
     def _detach_volume(self, *args, **kwargs):
         # before detaching volumes, we want to call sync to make sure all the IOs are written to disk
@@ -151,11 +151,11 @@ def remove(config_parser, key):
 
 def apply(config_parser, address, pool_name, username, password, volume_backend_name=None, thick_provisioning=False, prefer_fc=False, infinidat_allow_pool_not_found=False, infinidat_purge_volume_on_deletion=False):
     import sys
-    from infinisdk import InfiniBox
     from infinisdk.core.exceptions import SystemNotFoundException
+    from infinidat_openstack.sessions import create_infinibox
     from infinidat_openstack.versioncheck import raise_if_unsupported, get_system_version
     try:
-        system = InfiniBox(address, use_ssl=True, auth=(username, password))
+        system = create_infinibox(address, username, password, use_ssl=True)
     except SystemNotFoundException:
         system = None
     if system is None:
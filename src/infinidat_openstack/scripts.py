@@ -224,10 +224,9 @@ def get_infinisdk_for_volume_backend(volume_backend):
 
 
 def get_infinisdk_from_arguments(arguments):
-    from infinisdk import InfiniBox
+    from infinidat_openstack.sessions import get_session
     from infinidat_openstack.versioncheck import raise_if_unsupported, get_system_version
-    system = InfiniBox(arguments.address, use_ssl=True, auth=(arguments.username, arguments.password))
-    system.login()
+    system = get_session(arguments.address, arguments.username, arguments.password, use_ssl=True).system
     raise_if_unsupported(get_system_version(arguments.address, arguments.username, arguments.password, system))
     return system
 
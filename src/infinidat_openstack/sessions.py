@@ -0,0 +1,120 @@
+# Copyright 2016 Infinidat Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""A process-wide registry of logged-in InfiniBox clients.
+
+Volume backends that use the same system (and the same user) share one client, and with it one HTTP connection pool,
+along with the per-system caches they store on the session (e.g. hosts and target topology)"""
+
+from threading import Lock
+
+HTTP_CONNECTION_POOL_SIZE = 32
+
+_sessions = {}
+_sessions_lock = Lock()
+# logging in takes a while, so it is done under a lock of its own (address, username) and not under _sessions_lock
+_login_locks = {}
+
+
+class Session(object):
+    def __init__(self, address, username, password, use_ssl=False):
+        super(Session, self).__init__()
+        self.address = address
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.system = None
+        self._shared = {}
+        self._lock = Lock()
+
+    def connect(self):
+        self.system = create_infinibox(self.address, self.username, self.password, self.use_ssl)
+        _tune_connection_pool(self.system)
+        self.system.login()
+
+    def get_shared(self, key, factory):
+        """returns the object stored under key, creating it with factory() on first use"""
+        with self._lock:
+            if key not in self._shared:
+                self._shared[key] = factory()
+            return self._shared[key]
+
+    def __repr__(self):
+        return "<Session({0}@{1})>".format(self.username, self.address)
+
+
+def parse_address(address, use_ssl=False):
+    """parses an address of the form host, host:port or http[s]://host[:port], e.g. of a local stand-in of a system.
+    :returns: a (host, port, use_ssl) tuple, port is None when the address does not specify it"""
+    scheme, separator, rest = address.partition("://")
+    if separator:
+        use_ssl = scheme.lower() == "https"
+        address = rest
+    address = address.rstrip("/")
+    host, colon, port = address.rpartition(":")
+    if not colon or not port.isdigit() or ":" in host:  # no port, or an IPv6 address
+        return address, None, use_ssl
+    return host, int(port), use_ssl
+
+
+def create_infinibox(address, username, password, use_ssl=False):
+    from infinisdk import InfiniBox
+    host, port, use_ssl = parse_address(address, use_ssl)
+    return InfiniBox(host if port is None else (host, port), use_ssl=use_ssl, auth=(username, password))
+
+
+def _tune_connection_pool(system):
+    # infinisdk keeps its requests session on the api object. all the backends of this system send their requests
+    # through it concurrently, so we keep more connections alive than the requests default of 10.
+    # infinisdk replaces the requests session in api.reinitialize_session(), so we mount our adapter on every new one
+    api = system.api
+    if getattr(api, '_session', None) is None:
+        return
+    reinitialize_session = api.reinitialize_session
+
+    def reinitialize_tuned_session(*args, **kwargs):
+        reinitialize_session(*args, **kwargs)
+        _mount_connection_pool(api._session)
+    api.reinitialize_session = reinitialize_tuned_session
+    _mount_connection_pool(api._session)
+
+
+def _mount_connection_pool(http_session):
+    from requests.adapters import HTTPAdapter
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_CONNECTION_POOL_SIZE)
+    http_session.mount("http://", adapter)
+    http_session.mount("https://", adapter)
+
+
+def _get_login_lock(key):
+    with _sessions_lock:
+        return _login_locks.setdefault(key, Lock())
+
+
+def get_session(address, username, password, use_ssl=False):
+    key = (address, username)
+    with _get_login_lock(key):
+        session = _sessions.get(key)
+        if session is None or session.password != password or session.use_ssl != use_ssl:
+            session = Session(address, username, password, use_ssl)
+            session.connect()
+            with _sessions_lock:
+                _sessions[key] = session
+        return session
+
+
+def clear_sessions():
+    with _sessions_lock:
+        _sessions.clear()
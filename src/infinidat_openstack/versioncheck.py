@@ -31,8 +31,12 @@ def get_system_version(address, username, password, system):
     # infinisdk does not support InfiniBox-1.4 response style, so we need to use requests
     # but, if that fails (e.g. in case of invalid credentials), we want infinisdk exceptions
     import requests
+    from infinidat_openstack.sessions import parse_address
+    host, port, use_ssl = parse_address(address)
+    netloc = host if port is None else "{0}:{1}".format(host, port)
     try:
-        result = requests.get("http://{0}/api/rest/system/version".format(address), auth=(username, password)).json()
+        result = requests.get("{0}://{1}/api/rest/system/version".format("https" if use_ssl else "http", netloc),
+                              auth=(username, password)).json()
     except:
         return system.get_version()
     if isinstance(result, basestring):
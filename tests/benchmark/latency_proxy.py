@@ -0,0 +1,232 @@
+"""A local HTTP stand-in for the InfiniBox REST API that adds network-like latency, errors and concurrency limits.
+
+The simulator answers instantly, while a real system is a few milliseconds away. The proxy forwards every request to
+the simulator (or to the given upstream) after a delay drawn from the distribution of the first rule that matches it.
+Point the driver's san_ip, or the address of infini-openstack, at the printed address, e.g. http://127.0.0.1:8080
+
+Rules are read from a JSON list, for example:
+
+    [{"method": "POST", "url": "volumes", "latency": {"distribution": "lognormal", "median": 12, "sigma": 0.4},
+      "concurrency": 8},
+     {"url": "volumes/{id}/metadata*", "latency": 4, "error_rate": 0.01, "error_status": 503},
+     {"latency": {"distribution": "uniform", "min": 2, "max": 20}}]
+
+"method" and "url" (a shell pattern on the request path below /api/rest/, with object ids replaced by {id}) default to
+"*". Latencies are in milliseconds, either a number or one of the fixed (value), uniform (min, max), normal (mean,
+stddev) and lognormal (median, sigma) distributions. Requests over a rule's concurrency wait for a free slot, as they
+would on a saturated system, and a share of error_rate of the requests is answered with an error instead of forwarded.
+
+Usage:
+    latency_proxy.py [options]
+
+Options:
+    --port=<port>           port to listen on [default: 8080]
+    --rules=<path>          JSON file of per-endpoint rules
+    --latency=<ms>          fixed latency of the requests no rule matches [default: 0]
+    --upstream=<url>        forward to this system instead of starting a simulator, e.g. https://infinibox01
+"""
+import json
+import sys
+import random
+import requests
+from math import log
+from time import sleep
+from fnmatch import fnmatch
+from threading import Thread, Semaphore, Lock
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from infinidat_openstack.cinder.metrics import get_url_template
+
+API_PREFIX = "/api/rest/"
+# headers that describe the connection rather than the message, requests sets its own
+HOP_BY_HOP_HEADERS = ('connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+                      'transfer-encoding', 'upgrade', 'host', 'content-length', 'content-encoding')
+
+
+def make_distribution(spec, rng=random):
+    """returns a function that draws a latency, in seconds, from a spec in milliseconds"""
+    if spec is None:
+        spec = 0
+    if isinstance(spec, (int, float)):
+        spec = dict(distribution="fixed", value=spec)
+    distribution = spec.get("distribution", "fixed")
+    if distribution == "fixed":
+        draw = lambda: spec["value"]
+    elif distribution == "uniform":
+        draw = lambda: rng.uniform(spec["min"], spec["max"])
+    elif distribution == "normal":
+        draw = lambda: rng.normalvariate(spec["mean"], spec["stddev"])
+    elif distribution == "lognormal":
+        draw = lambda: rng.lognormvariate(log(spec["median"]), spec["sigma"])
+    else:
+        raise ValueError("unknown latency distribution: {0}".format(distribution))
+    return lambda: max(draw(), 0) / 1000.0
+
+
+class Rule(object):
+    def __init__(self, method="*", url="*", latency=None, error_rate=0, error_status=503, concurrency=None,
+                 rng=random):
+        super(Rule, self).__init__()
+        self.method = method.upper()
+        self.url = url
+        self.get_latency = make_distribution(latency, rng)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slots = Semaphore(concurrency) if concurrency else None
+        self._rng = rng
+
+    def matches(self, method, url_template):
+        return fnmatch(method, self.method) and fnmatch(url_template, self.url)
+
+    def should_fail(self):
+        return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+
+def load_rules(path, rng=random):
+    with open(path) as fd:
+        return [Rule(rng=rng, **dict((str(key), value) for key, value in rule.items())) for rule in json.load(fd)]
+
+
+def make_error(status):
+    """an error response body of the form the system sends"""
+    return json.dumps(dict(result=None, metadata=dict(ready=True),
+                           error=dict(code="INJECTED_ERROR", message="error injected by the latency proxy",
+                                      reasons=[], severity="ERROR", is_remote=False, data=None)))
+
+
+def get_response_headers(response):
+    """returns the (name, value) header lines of an upstream response to pass on. response.headers joins repeated
+    headers with commas, which breaks Set-Cookie (its expiry dates have commas), so each line is taken separately"""
+    headers = response.raw.headers
+    return [(key, value) for key in headers.keys() if key.lower() not in HOP_BY_HOP_HEADERS
+            for value in headers.getlist(key)]
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep the driver's connections alive, like the system does
+    disable_nagle_algorithm = True  # the headers and body are written separately, don't add delayed-ack stalls
+
+    def _handle(self):
+        self.server.proxy.handle(self)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LatencyProxy(object):
+    """forwards requests to upstream (e.g. http://<simulator address>), with the latency of the first matching rule"""
+
+    def __init__(self, upstream, rules=(), default_latency=None, host="127.0.0.1", port=0):
+        super(LatencyProxy, self).__init__()
+        self.upstream = upstream.rstrip("/")
+        self.rules = list(rules) + [Rule(latency=default_latency)]
+        self._server = _Server((host, port), _RequestHandler)
+        self._server.proxy = self
+        self._thread = None
+        self._lock = Lock()
+        self._counts = dict(requests=0, errors=0)
+
+    @property
+    def address(self):
+        return "http://{0}:{1}".format(*self._server.server_address)
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, name="latency-proxy")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def get_rule(self, method, path):
+        url_template = get_url_template(path.split(API_PREFIX, 1)[-1])
+        return next(rule for rule in self.rules if rule.matches(method, url_template))
+
+    def handle(self, handler):
+        length = int(handler.headers.getheader('content-length') or 0)
+        body = handler.rfile.read(length) if length else None
+        rule = self.get_rule(handler.command, handler.path)
+        if rule.slots is not None:
+            rule.slots.acquire()
+        try:
+            sleep(rule.get_latency())
+            if rule.should_fail():
+                self._count('errors')
+                self._respond(handler, rule.error_status, [('Content-Type', 'application/json')],
+                              make_error(rule.error_status))
+                return
+            headers = dict((key, value) for key, value in handler.headers.items()
+                           if key.lower() not in HOP_BY_HOP_HEADERS)
+            try:
+                response = requests.request(handler.command, self.upstream + handler.path, data=body,
+                                            headers=headers, allow_redirects=False, verify=False)
+            except requests.RequestException:
+                self._count('errors')
+                self._respond(handler, 502, [('Content-Type', 'application/json')], make_error(502))
+                return
+        finally:
+            if rule.slots is not None:
+                rule.slots.release()
+        self._count('requests')
+        self._respond(handler, response.status_code, get_response_headers(response), response.content)
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def _respond(self, handler, status, headers, content):
+        handler.send_response(status)
+        for key, value in headers:
+            handler.send_header(key, value)
+        handler.send_header('Content-Length', str(len(content or '')))
+        handler.end_headers()
+        if content and handler.command != 'HEAD':
+            handler.wfile.write(content)
+
+
+def main(argv=sys.argv[1:]):
+    from docopt import docopt
+    arguments = docopt(__doc__, argv=argv)
+    rules = load_rules(arguments['--rules']) if arguments['--rules'] else []
+    default_latency = float(arguments['--latency'])
+    upstream = arguments['--upstream']
+    if upstream:
+        proxy = LatencyProxy(upstream, rules, default_latency, port=int(arguments['--port']))
+        print "forwarding {0} to {1}".format(proxy.address, upstream)
+        proxy.serve_forever()
+        return
+    from capacity import TiB
+    from tests.benchmark.run import Simulator
+    with Simulator() as simulator:
+        pool = simulator.system.pools.create(physical_capacity=100 * TiB, virtual_capacity=100 * TiB)
+        proxy = LatencyProxy(simulator.get_url(), rules, default_latency, port=int(arguments['--port']))
+        print "forwarding {0} to a simulator with pool {1} (id {2})".format(proxy.address, pool.get_name(),
+                                                                            pool.get_id())
+        proxy.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
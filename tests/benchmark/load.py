@@ -0,0 +1,309 @@
+"""Replays cinder-like workloads against one InfiniboxVolumeDriver from concurrent workers.
+
+A cinder-volume service runs the requests of all its users on one driver instance, from many green threads. This
+runs a workload the given number of times from --workers threads that share one driver, so its throughput, latency
+under contention and thread safety can be measured, against the simulator (optionally behind the latency proxy) or a
+real system. The results, including the errors by step and type and a time series, are written as JSON.
+
+Workloads:
+    boot-storm          clone an image volume and attach the clone to a compute host
+    teardown            detach a volume from its compute host and delete it
+    cg-snapshot-cycle   snapshot a consistency group and delete the snapshot
+
+Usage:
+    load.py (boot-storm | teardown | cg-snapshot-cycle) [options]
+
+Options:
+    --workers=<count>       number of concurrent workers [default: 8]
+    --count=<count>         number of times the workload runs (default: 500, 1000 and 100 in the order above)
+    --hosts=<count>         number of compute hosts the volumes are attached to [default: 20]
+    --interval=<seconds>    length of the time series intervals [default: 1]
+    --address=<address>     run against this system instead of a simulator
+    --username=<username>   user name on the system [default: admin]
+    --password=<password>   password on the system [default: 123456]
+    --pool-id=<id>          id of the pool of the driver's volumes on the system, required with --address
+    --provisioning=<type>   provisioning type of the driver's volumes, thick or thin [default: thin]
+    --latency=<ms>          send the simulator requests through a latency proxy that delays them this long [default: 0]
+    --latency-rules=<path>  per-endpoint rules of the latency proxy, see latency_proxy.py
+    --no-cleanup            leave the volumes, hosts and groups that the workload created
+    --output=<path>         write the results to this file instead of stdout
+"""
+import json
+import sys
+from time import time
+from threading import Lock
+from contextlib import contextmanager
+from platform import platform
+from capacity import TiB
+from infinidat_openstack.cinder.parallel import map_concurrently, raise_first_error
+from tests.fakes import make_driver_configuration, make_driver, make_volume, make_consistencygroup, make_cgsnapshot
+from tests.fakes import make_fc_connector, make_wwpn, FakeDB
+from tests.benchmark.run import Simulator, percentile
+from tests.benchmark.latency_proxy import LatencyProxy, load_rules
+
+CG_SIZE = 5
+
+
+class Recorder(object):
+    """collects the latency and outcome of the steps that the workers run"""
+
+    def __init__(self, clock=time):
+        super(Recorder, self).__init__()
+        self.samples = []  # (step, seconds since start when finished, latency, error type or None)
+        self.error_messages = {}
+        self._lock = Lock()
+        self._clock = clock
+        self._start = clock()
+
+    def start(self):
+        self._start = self._clock()
+
+    def run(self, step, func, *args):
+        start = self._clock()
+        try:
+            value = func(*args)
+        except Exception as error:
+            self._add(step, start, error)
+            raise
+        self._add(step, start)
+        return value
+
+    def _add(self, step, start, error=None):
+        now = self._clock()
+        error_type = None if error is None else type(error).__name__
+        with self._lock:
+            self.samples.append((step, now - self._start, now - start, error_type))
+            if error is not None:
+                self.error_messages.setdefault(error_type, str(error))
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    return dict(count=len(values),
+                mean=sum(values) / len(values) if values else None,
+                p50=percentile(values, 50),
+                p90=percentile(values, 90),
+                p99=percentile(values, 99),
+                max=values[-1] if values else None)
+
+
+def build_report(recorder, workload_name, duration, interval):
+    steps, errors, buckets = {}, {}, {}
+    for step, finished, latency, error_type in recorder.samples:
+        if error_type is None:
+            steps.setdefault(step, []).append(latency)
+        else:
+            step_errors = errors.setdefault(step, {})
+            step_errors[error_type] = step_errors.get(error_type, 0) + 1
+        if step == workload_name:
+            bucket = buckets.setdefault(int(finished / interval), dict(latencies=[], errors=0))
+            if error_type is None:
+                bucket['latencies'].append(latency)
+            else:
+                bucket['errors'] += 1
+    completed = len(steps.get(workload_name, []))
+    time_series = [dict(time=index * interval, completed=len(buckets.get(index, {}).get('latencies', [])),
+                        errors=buckets.get(index, {}).get('errors', 0),
+                        p50=percentile(sorted(buckets.get(index, {}).get('latencies', [])), 50),
+                        p99=percentile(sorted(buckets.get(index, {}).get('latencies', [])), 99))
+                   for index in range(max(buckets) + 1 if buckets else 0)]
+    return dict(duration=duration,
+                completed=completed,
+                failed=sum(errors.get(workload_name, {}).values()),
+                throughput=completed / duration if duration else None,
+                latency=dict((step, summarize(latencies)) for step, latencies in steps.items()),
+                errors=errors,
+                error_messages=recorder.error_messages,
+                time_series=time_series)
+
+
+class Workload(object):
+    """the driver and workers a workload runs with. prepare(workload, count) creates the objects the workload needs,
+    untimed, and returns the units of work, run(workload, unit) is timed for each unit and cleanup(workload) deletes
+    what the workload created. they keep their state on the workload"""
+
+    def __init__(self, name, driver, recorder, workers, hosts, prepare, run, cleanup=None):
+        super(Workload, self).__init__()
+        self.name = name
+        self.driver = driver
+        self.recorder = recorder
+        self.workers = workers
+        self.hosts = hosts
+        self._prepare = prepare
+        self._run = run
+        self._cleanup = cleanup
+
+    def prepare(self, count):
+        return self._prepare(self, count)
+
+    def run(self, unit):
+        self._run(self, unit)
+
+    def cleanup(self):
+        if self._cleanup is not None:
+            self._cleanup(self)
+
+    def get_connector(self, index):
+        host_index = index % self.hosts
+        return make_fc_connector([make_wwpn(host_index)], host="compute{0:03}".format(host_index))
+
+    def create_volume(self, size=1):
+        cinder_volume = make_volume(size=size)
+        cinder_volume.update(self.driver.create_volume(cinder_volume) or {})
+        return cinder_volume
+
+    def map(self, func, items):
+        results = map_concurrently(func, items, self.workers)
+        raise_first_error(results)
+        return [result.value for result in results]
+
+
+def prepare_boot_storm(workload, count):
+    workload.image = workload.create_volume()
+    workload.attached = []
+    return [workload.get_connector(index) for index in range(count)]
+
+
+def run_boot_storm(workload, connector):
+    driver = workload.driver
+    cinder_clone = make_volume(size=workload.image.size)
+    model_update = workload.recorder.run('clone', driver.create_cloned_volume, cinder_clone, workload.image)
+    cinder_clone.update(model_update or {})
+    workload.recorder.run('attach', driver.initialize_connection, cinder_clone, connector)
+    workload.attached.append((cinder_clone, connector))
+
+
+def cleanup_boot_storm(workload):
+    def detach_and_delete(pair):
+        cinder_volume, connector = pair
+        workload.driver.terminate_connection(cinder_volume, connector)
+        workload.driver.delete_volume(cinder_volume)
+    workload.map(detach_and_delete, workload.attached)
+    workload.driver.delete_volume(workload.image)
+
+
+def prepare_teardown(workload, count):
+    units = [(None, workload.get_connector(index)) for index in range(count)]
+
+    def create_and_attach(index):
+        cinder_volume = workload.create_volume()
+        workload.driver.initialize_connection(cinder_volume, units[index][1])
+        units[index] = (cinder_volume, units[index][1])
+    workload.map(create_and_attach, range(count))
+    return units
+
+
+def run_teardown(workload, pair):
+    cinder_volume, connector = pair
+    workload.recorder.run('detach', workload.driver.terminate_connection, cinder_volume, connector)
+    workload.recorder.run('delete', workload.driver.delete_volume, cinder_volume)
+
+
+def prepare_cg_snapshot_cycle(workload, count):
+    driver = workload.driver
+
+    # a group per worker, so the workers contend on the driver and the system rather than on one group
+    def create_group(index):
+        cinder_cg = make_consistencygroup()
+        driver.create_consistencygroup(None, cinder_cg)
+        members = [workload.create_volume() for _ in range(CG_SIZE)]
+        for cinder_volume in members:
+            driver.db.add_group_volume(cinder_cg, cinder_volume)
+        driver.update_consistencygroup(None, cinder_cg, add_volumes=members)
+        return cinder_cg
+    workload.groups = workload.map(create_group, range(min(workload.workers, count)))
+    return [workload.groups[index % len(workload.groups)] for index in range(count)]
+
+
+def run_cg_snapshot_cycle(workload, cinder_cg):
+    driver = workload.driver
+    cgsnapshot = make_cgsnapshot(cinder_cg)
+    snapshots = driver.db.add_cgsnapshot(cgsnapshot)
+    workload.recorder.run('create_cgsnapshot', driver.create_cgsnapshot, None, cgsnapshot)
+    workload.recorder.run('delete_cgsnapshot', driver.delete_cgsnapshot, None, cgsnapshot, snapshots)
+
+
+def cleanup_cg_snapshot_cycle(workload):
+    def delete_group(cinder_cg):
+        workload.driver.delete_consistencygroup(None, cinder_cg,
+                                                workload.driver.db.volume_get_all_by_group(None, cinder_cg.id))
+    workload.map(delete_group, workload.groups)
+
+
+# name -> default count and the functions of the workload
+WORKLOADS = {
+    'boot-storm': dict(default_count=500, prepare=prepare_boot_storm, run=run_boot_storm,
+                       cleanup=cleanup_boot_storm),
+    'teardown': dict(default_count=1000, prepare=prepare_teardown, run=run_teardown),
+    'cg-snapshot-cycle': dict(default_count=100, prepare=prepare_cg_snapshot_cycle, run=run_cg_snapshot_cycle,
+                              cleanup=cleanup_cg_snapshot_cycle),
+}
+
+
+def run_workload(workload, count, interval, cleanup=True):
+    units = workload.prepare(count)
+    workload.recorder.start()
+    start = time()
+    map_concurrently(lambda unit: workload.recorder.run(workload.name, workload.run, unit), units, workload.workers)
+    duration = time() - start
+    if cleanup:
+        workload.cleanup()
+    return build_report(workload.recorder, workload.name, duration, interval)
+
+
+@contextmanager
+def system_address(arguments):
+    """yields the address and pool id to run against, starting a simulator (and a latency proxy) if needed"""
+    if arguments['--address']:
+        yield arguments['--address'], int(arguments['--pool-id']), None
+        return
+    with Simulator() as simulator:
+        pool = simulator.system.pools.create(physical_capacity=100 * TiB, virtual_capacity=100 * TiB)
+        latency, rules_path = float(arguments['--latency']), arguments['--latency-rules']
+        if not (latency or rules_path):
+            yield simulator.get_address(), pool.get_id(), None
+            return
+        rules = load_rules(rules_path) if rules_path else []
+        with LatencyProxy(simulator.get_url(), rules, latency) as proxy:
+            yield proxy.address, pool.get_id(), proxy
+
+
+def main(argv=sys.argv[1:]):
+    from docopt import docopt
+    from infinidat_openstack.__version__ import __version__
+    arguments = docopt(__doc__, argv=argv)
+    name = next(name for name in WORKLOADS if arguments[name])
+    functions = dict(WORKLOADS[name])
+    default_count = functions.pop('default_count')
+    parameters = dict(workload=name,
+                      workers=int(arguments['--workers']),
+                      count=int(arguments['--count'] or default_count),
+                      hosts=int(arguments['--hosts']),
+                      provisioning=arguments['--provisioning'],
+                      latency=float(arguments['--latency']),
+                      latency_rules=arguments['--latency-rules'],
+                      simulator=not arguments['--address'])
+    with system_address(arguments) as (address, pool_id, proxy):
+        configuration = make_driver_configuration(address, pool_id, parameters['provisioning'], "load",
+                                                  san_login=arguments['--username'],
+                                                  san_password=arguments['--password'])
+        driver = make_driver(configuration, FakeDB())
+        workload = Workload(name, driver, Recorder(), parameters['workers'], parameters['hosts'], **functions)
+        results = run_workload(workload, parameters['count'], float(arguments['--interval']),
+                               cleanup=not arguments['--no-cleanup'])
+        results['driver_operations'] = driver._metrics.get_stats()
+        if proxy is not None:
+            results['proxy'] = proxy.get_stats()
+    report = dict(parameters=parameters,
+                  environment=dict(driver_version=__version__, platform=platform(), python=sys.version.split()[0]),
+                  results=results)
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if arguments['--output']:
+        with open(arguments['--output'], "w") as fd:
+            fd.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Benchmarks InfiniboxVolumeDriver against the infinisim simulator.
+
+The simulator is populated with driver-like volumes, hosts and mappings first, so the driver's lookups run against a
+system of realistic size. Each operation is then run the given number of times, and the results are written as JSON.
+
+Usage:
+    run.py [options]
+
+Options:
+    --volumes=<count>       number of volumes to populate the system with [default: 1000]
+    --hosts=<count>         number of hosts to populate the system with [default: 100]
+    --mappings=<count>      number of volumes mapped to each populated host [default: 10]
+    --iterations=<count>    number of times each operation is run [default: 50]
+    --provisioning=<type>   provisioning type of the driver's volumes, thick or thin [default: thin]
+    --output=<path>         write the results to this file instead of stdout
+    --latency=<ms>          send the driver's requests through a latency proxy that delays them this long [default: 0]
+    --latency-rules=<path>  per-endpoint rules of the latency proxy, see latency_proxy.py
+"""
+import json
+import sys
+from time import time
+from platform import platform
+from capacity import GiB, TiB
+from tests.fakes import make_driver_configuration, make_driver, make_volume, make_snapshot
+from tests.fakes import make_consistencygroup, make_fc_connector, make_wwpn, FakeDB
+from tests.benchmark.latency_proxy import LatencyProxy, load_rules
+
+# the operations in the order they run, each consumes the objects created by the ones before it
+OPERATIONS = ('create', 'snapshot', 'clone', 'attach', 'detach', 'delete_snapshot', 'delete_clone', 'delete',
+              'cg_create', 'cg_delete')
+# the driver methods each operation calls, whose REST calls we report
+DRIVER_METHODS = dict(create=('create_volume',), snapshot=('create_snapshot',), clone=('create_cloned_volume',),
+                      attach=('initialize_connection',), detach=('terminate_connection',),
+                      delete_snapshot=('delete_snapshot',), delete_clone=('delete_volume',), delete=('delete_volume',),
+                      cg_create=('create_consistencygroup', 'update_consistencygroup'),
+                      cg_delete=('delete_consistencygroup',))
+CG_SIZE = 5
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed, rest_calls):
+    values = sorted(latencies)
+    count = len(values) + errors
+    return dict(count=count,
+                errors=errors,
+                ops_per_sec=len(values) / elapsed if elapsed else None,
+                mean=sum(values) / len(values) if values else None,
+                p50=percentile(values, 50),
+                p99=percentile(values, 99),
+                max=values[-1] if values else None,
+                rest_calls_per_op=float(rest_calls) / count if count else None)
+
+
+class Simulator(object):
+    def __init__(self):
+        super(Simulator, self).__init__()
+        self.simulator = None
+        self.system = None
+
+    def __enter__(self):
+        from infinisim.infinibox import Infinibox
+        from infinisdk import InfiniBox
+        self.simulator = Infinibox()
+        self.simulator.activate()
+        self.system = InfiniBox(self.simulator, auth=('admin', '123456'))
+        self.system.login()
+        return self
+
+    def __exit__(self, *args):
+        self.simulator.deactivate()
+
+    def get_address(self):
+        return self.system.get_api_addresses()[0][0]
+
+    def get_url(self):
+        return "http://{0}:{1}".format(*self.system.get_api_addresses()[0])
+
+
+def populate(system, pool, configuration, volumes, hosts, mappings):
+    """creates volumes, hosts and mappings the way the driver names them"""
+    from infi.dtypes.wwn import WWN
+    infinidat_volumes = [system.volumes.create(name="{0}-{1}".format(configuration.infinidat_volume_name_prefix,
+                                                                      make_volume().id),
+                                               pool=pool, size=GiB, provisioning='THIN')
+                         for _ in range(volumes)]
+    for index in range(hosts):
+        wwpn = make_wwpn(index)
+        host = system.hosts.create(name="{0}-{1}".format(configuration.infinidat_host_name_prefix, wwpn))
+        host.add_port(WWN(wwpn))
+        for offset in range(mappings):
+            host.map_volume(infinidat_volumes[(index * mappings + offset) % len(infinidat_volumes)])
+
+
+class Benchmark(object):
+    def __init__(self, driver, iterations, hosts):
+        super(Benchmark, self).__init__()
+        self.driver = driver
+        self.iterations = iterations
+        self.volumes = []
+        self.snapshots = []
+        self.clones = []
+        self.groups = []
+        # the ports of the populated hosts, so attach measures what it does for the hosts of a running system
+        self.connectors = [make_fc_connector([make_wwpn(index % max(hosts, 1))]) for index in range(iterations)]
+
+    def _run(self, operation, calls):
+        methods = DRIVER_METHODS[operation]
+        rest_calls_before = self._get_rest_calls(methods)
+        latencies, errors = [], 0
+        start = time()
+        for call in calls:
+            call_start = time()
+            try:
+                call()
+            except Exception:
+                errors += 1
+            else:
+                latencies.append(time() - call_start)
+        elapsed = time() - start
+        return summarize(latencies, errors, elapsed, self._get_rest_calls(methods) - rest_calls_before)
+
+    def _get_rest_calls(self, methods):
+        # the operations run one after the other, so the difference is the calls of the current operation
+        stats = self.driver._metrics.get_stats()
+        return sum(stats.get(method, {}).get('rest_calls', 0) for method in methods)
+
+    def _create(self, collection, create):
+        def call():
+            collection.append(create())
+        return call
+
+    def run(self):
+        driver, iterations = self.driver, self.iterations
+
+        def create_volume():
+            cinder_volume = make_volume()
+            driver.create_volume(cinder_volume)
+            return cinder_volume
+
+        def create_snapshot(cinder_volume):
+            cinder_snapshot = make_snapshot(cinder_volume)
+            driver.create_snapshot(cinder_snapshot)
+            return cinder_snapshot
+
+        def create_clone(cinder_volume):
+            cinder_clone = make_volume(size=cinder_volume.size)
+            driver.create_cloned_volume(cinder_clone, cinder_volume)
+            return cinder_clone
+
+        def create_group(members):
+            cinder_cg = make_consistencygroup()
+            driver.create_consistencygroup(None, cinder_cg)
+            for cinder_volume in members:
+                driver.db.add_group_volume(cinder_cg, cinder_volume)
+            driver.update_consistencygroup(None, cinder_cg, add_volumes=members)
+            return cinder_cg
+
+        def delete_group(cinder_cg):
+            driver.delete_consistencygroup(None, cinder_cg, driver.db.volume_get_all_by_group(None, cinder_cg.id))
+
+        results = dict()
+        results['create'] = self._run('create', [self._create(self.volumes, create_volume)] * iterations)
+        results['snapshot'] = self._run('snapshot', [self._create(self.snapshots, lambda volume=volume: create_snapshot(volume))
+                                                     for volume in self.volumes])
+        results['clone'] = self._run('clone', [self._create(self.clones, lambda volume=volume: create_clone(volume))
+                                               for volume in self.volumes])
+        pairs = zip(self.volumes, self.connectors)
+        results['attach'] = self._run('attach', [lambda pair=pair: driver.initialize_connection(*pair) for pair in pairs])
+        results['detach'] = self._run('detach', [lambda pair=pair: driver.terminate_connection(*pair) for pair in pairs])
+        results['delete_snapshot'] = self._run('delete_snapshot', [lambda snapshot=snapshot: driver.delete_snapshot(snapshot)
+                                                                   for snapshot in self.snapshots])
+        results['delete_clone'] = self._run('delete_clone', [lambda clone=clone: driver.delete_volume(clone)
+                                                             for clone in self.clones])
+        results['delete'] = self._run('delete', [lambda volume=volume: driver.delete_volume(volume)
+                                                 for volume in self.volumes])
+        group_members = [[create_volume() for _ in range(CG_SIZE)] for _ in range(iterations)]
+        results['cg_create'] = self._run('cg_create', [self._create(self.groups, lambda members=members: create_group(members))
+                                                       for members in group_members])
+        results['cg_delete'] = self._run('cg_delete', [lambda group=group: delete_group(group) for group in self.groups])
+        return results
+
+
+def main(argv=sys.argv[1:]):
+    from docopt import docopt
+    from infinidat_openstack.__version__ import __version__
+    arguments = docopt(__doc__, argv=argv)
+    parameters = dict(volumes=int(arguments['--volumes']),
+                      hosts=int(arguments['--hosts']),
+                      mappings=int(arguments['--mappings']),
+                      iterations=int(arguments['--iterations']),
+                      provisioning=arguments['--provisioning'],
+                      latency=float(arguments['--latency']),
+                      latency_rules=arguments['--latency-rules'])
+    with Simulator() as simulator:
+        pool = simulator.system.pools.create(physical_capacity=100 * TiB, virtual_capacity=100 * TiB)
+        proxy = None
+        address = simulator.get_address()
+        if parameters['latency'] or parameters['latency_rules']:
+            rules = load_rules(parameters['latency_rules']) if parameters['latency_rules'] else []
+            proxy = LatencyProxy(simulator.get_url(), rules, parameters['latency']).start()
+            address = proxy.address
+        configuration = make_driver_configuration(address, pool.get_id(), parameters['provisioning'], "benchmark")
+        start = time()
+        populate(simulator.system, pool, configuration,
+                 parameters['volumes'], parameters['hosts'], parameters['mappings'])
+        populate_duration = time() - start
+        try:
+            driver = make_driver(configuration, FakeDB())
+            results = Benchmark(driver, parameters['iterations'], parameters['hosts']).run()
+        finally:
+            if proxy is not None:
+                proxy.stop()
+    report = dict(parameters=parameters,
+                  environment=dict(driver_version=__version__, platform=platform(), python=sys.version.split()[0]),
+                  populate_duration=populate_duration,
+                  operations=[dict(results[operation], name=operation) for operation in OPERATIONS])
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if arguments['--output']:
+        with open(arguments['--output'], "w") as fd:
+            fd.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Munch-based stand-ins for the objects cinder hands to the volume driver, for driving InfiniboxVolumeDriver directly
+(against the simulator or a real system) without a cinder deployment"""
+from uuid import uuid4
+from munch import Munch
+from contextlib import contextmanager
+from infinidat_openstack.cinder.volume import InfiniboxVolumeDriver, volume_opts
+from infinidat_openstack.cinder.metrics import get_url_template
+
+
+def make_driver_configuration(san_ip, pool_id, provisioning='thick', config_group=None, **kwargs):
+    configuration = Munch(**{item.name: item.default for item in volume_opts})
+    configuration.update(san_ip=san_ip,
+                         infinidat_pool_id=pool_id,
+                         san_login="admin", san_password="123456",
+                         infinidat_provision_type=provisioning,
+                         config_group=config_group)
+    configuration.update(kwargs)
+    configuration.append_config_values = lambda values: None
+    configuration.safe_get = lambda key: configuration.get(key, None)
+    return configuration
+
+
+def make_driver(configuration, db=None):
+    """returns an InfiniboxVolumeDriver that was set up with the configuration"""
+    driver = InfiniboxVolumeDriver(configuration=configuration)
+    driver.db = FakeDB() if db is None else db
+    driver.do_setup(Munch())
+    return driver
+
+
+def make_mock_driver(**kwargs):
+    """returns an InfiniboxVolumeDriver whose system is a Mock, for checking the driver without a simulator"""
+    from mock import Mock
+    driver = InfiniboxVolumeDriver(configuration=make_driver_configuration("mock", 1, 'thin', "mock", **kwargs))
+    driver.system = Mock()
+    return driver
+
+
+def make_mock_object(object_id, **fields):
+    """returns a Mock of an InfiniBox object, whose get_field() returns the given fields"""
+    from mock import Mock
+    obj = Mock()
+    obj.get_id.return_value = object_id
+    obj.id = object_id
+    obj.get_field.side_effect = lambda name, **kwargs: fields.get(name)
+    return obj
+
+
+def make_volume(size=1, display_name=None, **kwargs):
+    volume_id = str(uuid4())
+    return Munch(id=volume_id, size=size, status='available', display_name=display_name, **kwargs)
+
+
+def make_snapshot(cinder_volume, display_name=None, **kwargs):
+    snapshot_id = str(uuid4())
+    return Munch(id=snapshot_id, status='available', display_name=display_name,
+                 volume=cinder_volume, volume_id=cinder_volume.id, volume_size=cinder_volume.size, **kwargs)
+
+
+def make_consistencygroup(name=None):
+    cg_id = str(uuid4())
+    return Munch(id=cg_id, name=name or cg_id, status='available')
+
+
+def make_cgsnapshot(cinder_cg, name=None):
+    cgsnapshot_id = str(uuid4())
+    return Munch(id=cgsnapshot_id, name=name or cgsnapshot_id, status='available',
+                 consistencygroup_id=cinder_cg.id, consistencygroup=cinder_cg)
+
+
+def make_fc_connector(wwpns, host="openstack01"):
+    return {u'host': host, u'ip': u'127.0.0.1', u'wwpns': list(wwpns), u'wwnns': list(wwpns)}
+
+
+def make_wwpn(index):
+    return "10000000c9{0:06x}".format(index)
+
+
+class FakeDB(object):
+    """the parts of cinder's db api that the driver calls, for consistency groups and their snapshots"""
+
+    def __init__(self):
+        super(FakeDB, self).__init__()
+        self.volumes_by_group = {}
+        self.snapshots_by_cgsnapshot = {}
+
+    def add_group_volume(self, cinder_cg, cinder_volume):
+        cinder_volume.consistencygroup = cinder_cg
+        cinder_volume.consistencygroup_id = cinder_cg.id
+        self.volumes_by_group.setdefault(cinder_cg.id, []).append(cinder_volume)
+
+    def add_cgsnapshot(self, cgsnapshot):
+        """creates the member snapshots of a cgsnapshot, one for every volume of its group"""
+        snapshots = [make_snapshot(cinder_volume, cgsnapshot_id=cgsnapshot.id)
+                     for cinder_volume in self.volumes_by_group.get(cgsnapshot.consistencygroup_id, [])]
+        self.snapshots_by_cgsnapshot[cgsnapshot.id] = snapshots
+        return snapshots
+
+    def volume_get_all_by_group(self, context, group_id):
+        return list(self.volumes_by_group.get(group_id, []))
+
+    def snapshot_get_all_for_cgsnapshot(self, context, cgsnapshot_id):
+        return list(self.snapshots_by_cgsnapshot.get(cgsnapshot_id, []))
+
+
+class FakeClock(object):
+    """a clock that only moves when told to, for the caches and waits that take a clock"""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RequestCounter(object):
+    """a counting shim around the requests an infinisdk client sends, from all threads"""
+
+    def __init__(self, system):
+        super(RequestCounter, self).__init__()
+        self.requests = []
+        request = system.api.request
+
+        def counting_request(*args, **kwargs):
+            method = args[0] if args else kwargs.get('http_method')
+            path = args[1] if len(args) > 1 else kwargs.get('path')
+            self.requests.append("{0} {1}".format(str(method).upper(), get_url_template(path)))
+            return request(*args, **kwargs)
+        system.api.request = counting_request
+
+    @contextmanager
+    def counting(self):
+        """yields the list of the requests sent in the block"""
+        self.requests = requests = []
+        yield requests
@@ -1,6 +1,5 @@
 from os import path
 from time import sleep
-from uuid import uuid4
 from mock import MagicMock
 from munch import Munch
 from unittest import SkipTest
@@ -14,9 +13,10 @@ from infi.pyutils.contexts import contextmanager
 from infi.pyutils.retry import retry_func, WaitAndRetryStrategy
 from infi.vendata.integration_tests import TestCase
 from infi.vendata.smock import HostMock
-from infinidat_openstack.cinder.volume import InfiniboxVolumeDriver, volume_opts
+from infinidat_openstack.cinder.volume import InfiniboxVolumeDriver
 from infinidat_openstack import config, scripts
 from tests.test_common import ensure_package_is_installed, remove_package, is_devstack, get_admin_password
+from tests.fakes import make_driver_configuration, make_volume, make_snapshot
 from logging import getLogger
 logger = getLogger(__name__)
 
@@ -575,6 +575,8 @@ class MockTestCaseMixin(OpenStackFibreChannelTestCase):
 
     @classmethod
     def setup_infinibox(cls):
+        from infinidat_openstack.sessions import clear_sessions
+        clear_sessions()
         cls.infinisdk = cls.smock.get_inventory().add_infinibox()
         cls.apply_cinder_patches()
 
@@ -585,14 +587,9 @@ class MockTestCaseMixin(OpenStackFibreChannelTestCase):
     @classmethod
     @contextmanager
     def cinder_context(cls, infinisdk, pool, provisioning='thick', volume_backend_name=None):
-        volume_driver_config = Munch(**{item.name: item.default for item in volume_opts})
-        volume_driver_config.update(san_ip=infinisdk.get_api_addresses()[0][0],
-                                    infinidat_pool_id=pool.get_id(),
-                                    san_login="admin", san_password="123456",
-                                    infinidat_provision_type=provisioning,
-                                    config_group="infinibox-{0}-pool-{1}".format(infinisdk.get_serial(), pool.get_id()))
-        volume_driver_config.append_config_values = lambda values: None
-        volume_driver_config.safe_get = lambda key: volume_driver_config.get(key, None)
+        config_group = "infinibox-{0}-pool-{1}".format(infinisdk.get_serial(), pool.get_id())
+        volume_driver_config = make_driver_configuration(infinisdk.get_api_addresses()[0][0], pool.get_id(),
+                                                         provisioning, config_group)
         volume_driver = InfiniboxVolumeDriver(configuration=volume_driver_config)
         volume_drive_context = Munch()
         volume_driver.do_setup(cls.cinder_context)
@@ -626,8 +623,8 @@ class MockTestCaseMixin(OpenStackFibreChannelTestCase):
 
             volume_type = cls.volume_driver_by_type.keys()[0] if volume_type is None else volume_type
             volume_driver = cls.volume_driver_by_type[volume_type]
-            volume_id = str(uuid4())
-            cinder_volume = cls.volumes.setdefault(volume_id, Munch(size=size, id=volume_id, status='available', display_name=None))
+            cinder_volume = make_volume(size)
+            cls.volumes[cinder_volume.id] = cinder_volume
             cinder_volume.volume_type = volume_type
             cinder_volume.get = lambda *args, **kwargs: get(cinder_volume)
             cinder_volume.delete = lambda: delete(cinder_volume)
@@ -679,10 +676,10 @@ class MockTestCaseMixin(OpenStackFibreChannelTestCase):
                 volume_driver.delete_snapshot(cinder_snapshot)
                 cls.volumes.pop(cinder_snapshot.id)
 
-            snapshot_id = str(uuid4())
             source_cinder_volume = cls.volumes[cinder_volume_id]
             volume_driver = cls.volume_driver_by_type[source_cinder_volume.volume_type]
-            cinder_snapshot = cls.volumes.setdefault(snapshot_id, Munch(id=snapshot_id, status='available', display_name=None, volume=source_cinder_volume))
+            cinder_snapshot = make_snapshot(source_cinder_volume)
+            cls.volumes[cinder_snapshot.id] = cinder_snapshot
             cinder_snapshot.get = lambda  *args, **kwargs: get(cinder_snapshot)
             cinder_snapshot.delete = lambda: delete(cinder_snapshot)
             volume_driver.create_snapshot(cinder_snapshot)
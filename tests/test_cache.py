@@ -0,0 +1,188 @@
+from infinidat_openstack.cinder.cache import LRUCache, HostIndex, LunIndex, RefreshingCache, SnapshotReuseWindow
+from tests.fakes import FakeClock
+
+
+def test_hit_and_miss_counters():
+    cache = LRUCache(max_size=10, ttl=60)
+    assert cache.get("openstack-vol-1") is None
+    cache.set("openstack-vol-1", 1000)
+    assert cache.get("openstack-vol-1") == 1000
+    assert cache.get_stats() == dict(hits=1, misses=1, size=1)
+
+
+def test_entries_expire():
+    clock = FakeClock()
+    cache = LRUCache(max_size=10, ttl=60, clock=clock)
+    cache.set("openstack-vol-1", 1000)
+    clock.now = 59
+    assert cache.get("openstack-vol-1") == 1000
+    clock.now = 60
+    assert cache.get("openstack-vol-1") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_pop_invalidates():
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.pop("a")
+    cache.pop("not-there")
+    assert cache.get("a") is None
+
+
+def test_discard_only_removes_the_given_value():
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set("a", 1)
+    assert not cache.discard("a", 2)
+    assert cache.get("a") == 1
+    assert cache.discard("a", 1)
+    assert cache.get("a") is None
+    assert not cache.discard("a", 1)
+
+
+def test_zero_size_disables_the_cache():
+    cache = LRUCache(max_size=0, ttl=60)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_host_index():
+    index = HostIndex()
+    index.load({"openstack-host-10000000c99115ea": 1, "openstack-host-10000000c99115eb": 2})
+    assert index.get("openstack-host-10000000c99115ea") == 1
+    index.set("openstack-host-iqn.1993-08.org.debian.01.1cef2344a325", 3)
+    index.discard_id(1)
+    index.pop("openstack-host-10000000c99115eb")
+    assert index.get("openstack-host-10000000c99115ea") is None
+    assert index.get("openstack-host-10000000c99115eb") is None
+    assert len(index) == 1
+
+
+def test_lun_index():
+    clock = FakeClock()
+    index = LunIndex(ttl=60, clock=clock)
+    assert not index.is_loaded(1)
+    index.set(1, 100, 11)  # ignored until the host's mappings are loaded
+    assert index.get(1, 100) is None
+    index.load(1, [(100, 11), (101, 12)])
+    assert index.is_loaded(1)
+    index.set(1, 102, 13)
+    index.pop(1, 100)
+    assert [index.get(1, volume_id) for volume_id in (100, 101, 102)] == [None, 12, 13]
+    index.load(2, [(101, 1)])
+    index.discard_volume(101)
+    assert index.get(1, 101) is None and index.get(2, 101) is None
+    clock.now = 60
+    assert not index.is_loaded(1)
+    index.forget_host(1)
+    assert index.get(1, 101) is None
+
+
+def test_refreshing_cache():
+    values = dict(fc=["5742b0f000007b11"], iscsi=dict(iqn="iqn.2009-11.com.infinidat:storage:infinibox-sn-1"))
+    calls = []
+
+    def fetcher(key):
+        def fetch():
+            calls.append(key)
+            return values[key]
+        return fetch
+
+    cache = RefreshingCache()
+    assert cache.get("fc", fetcher("fc")) == ["5742b0f000007b11"]
+    assert cache.get("fc", fetcher("fc")) == ["5742b0f000007b11"]
+    assert calls == ["fc"]
+    cache.get("iscsi", fetcher("iscsi"))
+    values["fc"] = ["5742b0f000007b12"]
+    cache.refresh()
+    assert cache.get("fc", fetcher("fc")) == ["5742b0f000007b12"]
+    assert sorted(calls) == ["fc", "fc", "iscsi", "iscsi"]
+    cache.invalidate()
+    cache.get("fc", fetcher("fc"))
+    assert len(calls) == 5
+
+
+def test_refreshing_cache_drops_keys_that_fail_to_refresh():
+    values = dict(fc=["5742b0f000007b11"])
+    cache = RefreshingCache()
+    cache.get("fc", lambda: values["fc"])
+    values.pop("fc")
+    try:
+        cache.refresh()
+    except KeyError:
+        pass
+    else:
+        assert False, "refresh did not raise"
+    values["fc"] = ["5742b0f000007b12"]
+    assert cache.get("fc", lambda: values["fc"]) == ["5742b0f000007b12"]
+
+
+class FakeSnapshot(object):
+    def __init__(self, snapshot_id):
+        self.snapshot_id = snapshot_id
+
+    def get_id(self):
+        return self.snapshot_id
+
+
+def test_snapshot_reuse_window():
+    clock = FakeClock()
+    window = SnapshotReuseWindow(window=30, clock=clock)
+    snapshot_ids = iter(range(100, 200))
+
+    def create():
+        return FakeSnapshot(next(snapshot_ids))
+    snapshot, created = window.get_or_create(1, create)
+    assert (snapshot.get_id(), created) == (100, True)
+    snapshot, created = window.get_or_create(1, create)
+    assert (snapshot.get_id(), created) == (100, False)
+    assert window.get_or_create(2, create)[0].get_id() == 101
+    clock.now = 30
+    assert window.get_or_create(1, create)[0].get_id() == 102
+    window.discard_snapshot(102)
+    assert window.get_or_create(1, create)[0].get_id() == 103
+    window.pop(1)
+    assert window.get_or_create(1, create)[0].get_id() == 104
+
+
+def test_snapshot_reuse_window_disabled():
+    window = SnapshotReuseWindow(window=0)
+    snapshot_ids = iter(range(100, 200))
+    assert window.get_or_create(1, lambda: FakeSnapshot(next(snapshot_ids)))[0].get_id() == 100
+    assert window.get_or_create(1, lambda: FakeSnapshot(next(snapshot_ids)))[0].get_id() == 101
+    assert len(window) == 0
+
+
+def test_snapshot_reuse_window_defers_deletion_while_clones_are_in_flight():
+    window = SnapshotReuseWindow(window=30, clock=FakeClock())
+    snapshot, _ = window.get_or_create(1, lambda: FakeSnapshot(100))
+    assert window.get_or_create(1, lambda: FakeSnapshot(101))[0] is snapshot
+    with window.deletion(100) as may_delete:
+        assert not may_delete
+    assert len(window) == 0  # the next clone takes a new snapshot
+    assert not window.release(100)
+    assert window.release(100)  # the last clone in flight tries the deletion again
+    with window.deletion(100) as may_delete:
+        assert may_delete
+    assert window._source_locks == {}
+
+
+def test_snapshot_reuse_window_deletion_of_an_unknown_snapshot():
+    window = SnapshotReuseWindow(window=30)
+    snapshot, _ = window.get_or_create(1, lambda: FakeSnapshot(100))
+    window.release(100)
+    with window.deletion(100) as may_delete:
+        assert may_delete
+    with window.deletion(200) as may_delete:
+        assert may_delete
+    assert not window.release(window.get_or_create(1, lambda: FakeSnapshot(101))[0].get_id())
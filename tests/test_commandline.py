@@ -298,6 +298,8 @@ class MockTestCase(CommandlineTestsMixin, MockInfiniBoxMixin, TestCase):
                 yield
 
     def setUp(self):
+        from infinidat_openstack.sessions import clear_sessions
+        clear_sessions()  # the sessions of previous tests point at simulators that are gone
         with open(self.CONFIG_FILE, 'w') as fd:
             pass
 
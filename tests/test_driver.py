@@ -0,0 +1,312 @@
+"""Driver behaviour checked against a mocked system, without a simulator"""
+from infinidat_openstack.cinder import volume
+from infinidat_openstack.cinder.volume import exception
+from infinisdk.core.exceptions import ObjectNotFound
+from tests.fakes import (FakeClock, make_mock_driver, make_mock_object, make_volume, make_snapshot,
+                         make_consistencygroup, make_cgsnapshot)
+from mock import Mock, patch
+import pytest
+
+
+def test_delete_of_a_volume_with_children_is_refused():
+    driver = make_mock_driver()
+    infinidat_volume = make_mock_object(100, has_children=True, parent=None)
+    with pytest.raises(exception.VolumeIsBusy):
+        driver._delete_infinidat_volume(make_volume(), infinidat_volume)
+    assert not infinidat_volume.delete.called
+
+
+def test_purge_deletes_a_volume_with_children():
+    driver = make_mock_driver(infinidat_purge_volume_on_deletion=True)
+    driver._purge_infinidat_volume = Mock()
+    infinidat_volume = make_mock_object(100, has_children=True, parent=None)
+    driver._delete_infinidat_volume(make_volume(), infinidat_volume)
+    driver._purge_infinidat_volume.assert_called_once_with(infinidat_volume)
+
+
+def make_volume_tree(family_id_supported):
+    """a volume with a snapshot, a clone of the snapshot and a snapshot of another volume of the family"""
+    root = make_mock_object(100, family_id=1, parent=0, mapped=True)
+    snapshot = make_mock_object(101, name="snapshot", family_id=1, parent=100, mapped=False)
+    clone = make_mock_object(102, name="clone", family_id=1, parent=101, mapped=True)
+    other = make_mock_object(103, name="other", family_id=1, parent=99, mapped=False)
+    nodes = [root, snapshot, clone, other]
+    for node in nodes:
+        node.is_field_supported.return_value = family_id_supported
+    return nodes
+
+
+def purge(driver, root, nodes):
+    """purges root, and returns the ids of the nodes in the order they were deleted"""
+    deleted = []
+    for node in nodes:
+        node.delete.side_effect = lambda node=node: deleted.append(node.get_id())
+    driver._purge_infinidat_volume(root)
+    return deleted
+
+
+def test_purge_fetches_the_family_in_one_query_and_deletes_from_the_leaves_up():
+    driver = make_mock_driver(infinidat_purge_volume_on_deletion=True)
+    nodes = root, snapshot, clone, other = make_volume_tree(family_id_supported=True)
+    driver.system.volumes.find.return_value = nodes
+    assert purge(driver, root, nodes) == [102, 101, 100]
+    assert root.unmap.called and clone.unmap.called and not snapshot.unmap.called
+    assert driver.system.volumes.find.call_count == 1
+
+
+def test_purge_fetches_the_tree_level_by_level_without_family_ids():
+    driver = make_mock_driver(infinidat_purge_volume_on_deletion=True)
+    nodes = root, snapshot, clone, _ = make_volume_tree(family_id_supported=False)
+    levels = iter([[snapshot], [clone], []])
+    driver.system.volumes.find.side_effect = lambda *args: next(levels)
+    assert purge(driver, root, nodes) == [102, 101, 100]
+    assert driver.system.volumes.find.call_count == 3  # one query per level, and one that finds no more children
+
+
+def test_cached_volume_is_returned_without_a_request():
+    driver = make_mock_driver()
+    cinder_volume = make_volume()
+    driver._lookup_cache.set(driver._create_volume_name(cinder_volume), 100)
+    driver._find_volume(cinder_volume)
+    driver.system.volumes.get_by_id_lazy.assert_called_once_with(100)
+    assert not driver.system.volumes.get_by_id_lazy.return_value.get_fields.called
+
+
+def test_stale_cached_volume_is_looked_up_again_where_it_is_used():
+    driver = make_mock_driver()
+    driver._set_volume_or_snapshot_metadata = Mock()
+    cinder_snapshot = make_snapshot(make_volume())
+    name = driver._create_volume_name(cinder_snapshot.volume)
+    driver._lookup_cache.set(name, 100)
+    stale = driver.system.volumes.get_by_id_lazy.return_value = make_mock_object(100)
+    stale.create_snapshot.side_effect = ObjectNotFound("volume 100 not found")
+    recreated = driver.system.volumes.get.return_value = make_mock_object(200)
+    recreated.create_snapshot.return_value = make_mock_object(300)
+    assert driver.create_snapshot(cinder_snapshot) == dict(provider_location='300')
+    driver.system.volumes.get.assert_called_once_with(name=name)
+    assert driver._lookup_cache.get(name) == 200
+
+
+def test_not_found_of_a_volume_that_was_just_looked_up_is_raised():
+    driver = make_mock_driver()
+    infinidat_volume = make_mock_object(100)
+    with pytest.raises(ObjectNotFound):
+        driver._call_on_volume("volume", infinidat_volume, Mock(side_effect=ObjectNotFound("volume 100 not found")))
+    assert not driver.system.volumes.get.called
+
+
+def test_indexed_host_is_used_without_a_request():
+    driver = make_mock_driver()
+    driver._host_index.set(driver._create_host_name_by_port("10000000c99115ea"), 10)
+    host = driver.system.hosts.get_by_id_lazy.return_value = make_mock_object(10)
+    func = Mock(return_value=11)
+    assert driver._call_on_host("10000000c99115ea", func, create=True) == 11
+    func.assert_called_once_with(host)
+    driver.system.hosts.get_by_id_lazy.assert_called_once_with(10)
+    assert not host.get_fields.called
+    assert not driver.system.hosts.create.called
+
+
+def test_stale_indexed_host_is_forgotten_and_created_again():
+    driver = make_mock_driver()
+    name = driver._create_host_name_by_port("10000000c99115ea")
+    driver._host_index.set(name, 10)
+    driver._lun_index.load(10, [(100, 11)])
+    stale = driver.system.hosts.get_by_id_lazy.return_value = make_mock_object(10)
+    created = driver.system.hosts.create.return_value = make_mock_object(20)
+    func = Mock(side_effect=lambda host: host.map_volume())
+    stale.map_volume.side_effect = ObjectNotFound("host 10 not found")
+    assert driver._call_on_host("10000000c99115ea", func, create=True) == created.map_volume.return_value
+    driver.system.hosts.create.assert_called_once_with(name=name)
+    assert driver._host_index.get(name) == 20
+    assert not driver._lun_index.is_loaded(10)
+
+
+def test_stale_indexed_host_of_a_detach_is_looked_up_again():
+    driver = make_mock_driver()
+    name = driver._create_host_name_by_port("10000000c99115ea")
+    driver._host_index.set(name, 10)
+    stale = driver.system.hosts.get_by_id_lazy.return_value = make_mock_object(10)
+    stale.unmap_volume.side_effect = ObjectNotFound("host 10 not found")
+    driver.system.hosts.get.side_effect = ObjectNotFound("no host named {0}".format(name))
+    func = Mock(side_effect=lambda host: host.unmap_volume())
+    with pytest.raises(ObjectNotFound):
+        driver._call_on_host("10000000c99115ea", func)
+    driver.system.hosts.get.assert_called_once_with(name=name)
+    assert driver._host_index.get(name) is None
+
+
+def test_drain_of_an_unknown_device_sleeps():
+    driver = make_mock_driver()
+    with patch("infinidat_openstack.cinder.volume.wait_for_drain") as wait_for_drain, \
+            patch("infinidat_openstack.cinder.volume.sleep") as sleep:
+        driver._wait_for_drain(None)
+    assert not wait_for_drain.called
+    sleep.assert_called_once_with(driver.configuration.infinidat_sync_sleep_duration)
+
+
+def test_drain_of_an_unreadable_device_sleeps():
+    driver = make_mock_driver()
+    with patch("infinidat_openstack.cinder.volume.wait_for_drain", side_effect=IOError(2, "No such file")), \
+            patch("infinidat_openstack.cinder.volume.sleep") as sleep:
+        driver._wait_for_drain("/dev/sdc")
+    sleep.assert_called_once_with(driver.configuration.infinidat_sync_sleep_duration)
+
+
+def test_unexpected_drain_errors_are_raised():
+    driver = make_mock_driver()
+    with patch("infinidat_openstack.cinder.volume.wait_for_drain", side_effect=ValueError()):
+        with pytest.raises(ValueError):
+            driver._wait_for_drain("/dev/sdc")
+
+
+@pytest.fixture
+def clock():
+    """a FakeClock as the driver's time(), with the host facts looked up anew"""
+    fake_clock = FakeClock()
+    with patch("infinidat_openstack.cinder.volume.time", fake_clock), \
+            patch.dict(volume._host_facts, {'values': None, 'expires_at': 0}):
+        yield fake_clock
+
+
+def test_host_facts_are_looked_up_again_after_the_refresh_interval(clock):
+    with patch("infinidat_openstack.cinder.volume.get_os_hostname", side_effect=["first", "second"]):
+        assert volume.get_host_facts()['hostname'] == "first"
+        clock.sleep(volume.HOST_FACTS_REFRESH_INTERVAL - 1)
+        assert volume.get_host_facts()['hostname'] == "first"
+        clock.sleep(1)
+        assert volume.get_host_facts()['hostname'] == "second"
+
+
+def test_unchanged_host_metadata_is_not_written_again(clock):
+    driver = make_mock_driver()
+    host = make_mock_object(10)
+    with patch("infinidat_openstack.cinder.volume.get_os_hostname", side_effect=["first", "second"]):
+        driver._set_host_metadata(host)
+        driver._set_host_metadata(host)
+        assert host.set_metadata_from_dict.call_count == 1
+        clock.sleep(volume.HOST_FACTS_REFRESH_INTERVAL)
+        driver._set_host_metadata(host)  # the hostname changed
+    assert host.set_metadata_from_dict.call_count == 2
+    assert host.set_metadata_from_dict.call_args[0][0]['hostname'] == "second"
+
+
+def make_polled_driver(total, free):
+    """a driver whose capacity poller is running, polled once with a pool of the given capacity"""
+    driver = make_mock_driver()
+    driver.pool = make_mock_object(1)
+    driver.system.pools.find.return_value = [make_mock_object(1, physical_capacity=total * volume.GiB,
+                                                              free_physical_capacity=free * volume.GiB)]
+    driver._capacity_poller = Mock()
+    driver._capacity_poller.is_running.return_value = True
+    driver._poll_capacity()
+    return driver
+
+
+def test_stats_are_served_from_the_polled_capacity(clock):
+    driver = make_polled_driver(10, 4)
+    driver.system.pools.find.reset_mock()
+    clock.sleep(30)
+    stats = driver.get_volume_stats(refresh=True)
+    assert not driver.system.pools.find.called
+    assert (stats['total_capacity_gb'], stats['free_capacity_gb']) == (10, 4)
+    assert stats['infinidat_capacity_age'] == 30
+
+
+def test_capacity_age_grows_while_polls_fail(clock):
+    driver = make_polled_driver(10, 4)
+    driver.system.pools.find.side_effect = IOError("connection refused")
+    clock.sleep(60)
+    with pytest.raises(IOError):
+        driver._poll_capacity()
+    stats = driver.get_volume_stats(refresh=True)
+    assert stats['free_capacity_gb'] == 4
+    assert stats['infinidat_capacity_age'] == 60
+    clock.sleep(60)
+    assert driver.get_volume_stats(refresh=True)['infinidat_capacity_age'] == 120
+
+
+def make_members(driver, create_member, create_name, count):
+    """cinder objects and the InfiniBox objects of the same names that a name-in-list query returns"""
+    members = [create_member() for _ in range(count)]
+    infinidat_objects = [make_mock_object(100 + index, name=create_name(member)) for index, member in enumerate(members)]
+    driver.system.volumes.find.return_value = infinidat_objects
+    return members, infinidat_objects
+
+
+def test_consistency_group_members_are_found_in_one_query_and_deleted_despite_a_failure():
+    driver = make_mock_driver()
+    members, infinidat_volumes = make_members(driver, make_volume, driver._create_volume_name, 3)
+    driver._delete_infinidat_volume = Mock(side_effect=lambda member, infinidat_volume: infinidat_volume.delete())
+    infinidat_volumes[1].delete.side_effect = RuntimeError("delete failed")
+    cinder_cg = make_consistencygroup()
+    model_update, members = driver.delete_consistencygroup(None, cinder_cg, members)
+    assert driver.system.volumes.find.call_count == 1
+    assert all(infinidat_volume.delete.called for infinidat_volume in infinidat_volumes)
+    assert [member.status for member in members] == ['deleted', 'error_deleting', 'deleted']
+    assert model_update == dict(status='error_deleting')
+
+
+def test_missing_cgsnapshot_members_are_treated_as_deleted():
+    driver = make_mock_driver()
+    cinder_volume = make_volume()
+    members, infinidat_snapshots = make_members(driver, lambda: make_snapshot(cinder_volume),
+                                                driver._create_snapshot_name, 3)
+    driver.system.volumes.find.return_value = infinidat_snapshots[1:]
+    driver._delete_infinidat_snapshot = Mock()
+    cgsnapshot = make_cgsnapshot(make_consistencygroup())
+    model_update, members = driver.delete_cgsnapshot(None, cgsnapshot, members)
+    assert driver.system.volumes.find.call_count == 1
+    assert driver._delete_infinidat_snapshot.call_count == 2
+    assert [member.status for member in members] == ['deleted'] * 3
+    assert model_update == dict(status=cgsnapshot.status)
+
+
+def test_cgsnapshot_members_are_matched_to_snapshots_by_parent_id():
+    driver = make_mock_driver()
+    driver._set_volume_or_snapshot_metadata = Mock()
+    driver._set_cg_metadata = Mock()
+    cinder_volumes = [make_volume() for _ in range(3)]
+    members = [make_snapshot(cinder_volume) for cinder_volume in cinder_volumes]
+    driver.db = Mock()
+    driver.db.snapshot_get_all_for_cgsnapshot.return_value = members
+    driver.system.volumes.find.return_value = [
+        make_mock_object(100 + index, name=driver._create_volume_name(cinder_volume))
+        for index, cinder_volume in enumerate(cinder_volumes)]
+    # the snapgroup lists its members in an order of its own
+    infinidat_snapshots = [make_mock_object(200 + index, parent=100 + index) for index in reversed(range(3))]
+    infinidat_cgsnap = driver.system.cons_groups.get.return_value.create_snapshot.return_value
+    infinidat_cgsnap.get_members.return_value = infinidat_snapshots
+    driver.create_cgsnapshot(None, make_cgsnapshot(make_consistencygroup()))
+    assert driver.system.volumes.find.call_count == 1
+    for infinidat_snapshot in infinidat_snapshots:
+        member = members[infinidat_snapshot.get_id() - 200]
+        infinidat_snapshot.update_name.assert_called_once_with(driver._create_snapshot_name(member))
+        assert not infinidat_snapshot.get_parent.called
+        assert driver._lookup_cache.get(driver._create_snapshot_name(member)) == infinidat_snapshot.get_id()
+    assert [member.status for member in members] == ['available'] * 3
+
+
+def test_plain_volume_delete_fetches_its_fields_with_the_lookup():
+    driver = make_mock_driver()
+    cinder_volume = make_volume()
+    name = driver._create_volume_name(cinder_volume)
+    infinidat_volume = make_mock_object(100, name=name, has_children=False, parent=0)
+    driver.system.volumes.find.return_value.only_fields.return_value = [infinidat_volume]
+    driver.delete_volume(cinder_volume)
+    driver.system.volumes.find.assert_called_once_with(name=name)
+    driver.system.volumes.find.return_value.only_fields.assert_called_once_with(
+        ['id', 'name'] + list(volume.VOLUME_DELETE_FIELDS))
+    assert not infinidat_volume.get_all_metadata.called
+    infinidat_volume.delete.assert_called_once_with()
+
+
+def test_volume_known_by_provider_id_is_fetched_with_its_fields_in_one_request():
+    driver = make_mock_driver()
+    cinder_volume = make_volume(provider_location='100')
+    infinidat_volume = make_mock_object(100, name=driver._create_volume_name(cinder_volume), size=volume.GiB)
+    driver.system.volumes.get_by_id_lazy.return_value = infinidat_volume
+    driver.extend_volume(cinder_volume, 2)
+    infinidat_volume.get_fields.assert_called_once_with(['name'] + list(volume.VOLUME_EXTEND_FIELDS))
+    assert not driver.system.volumes.find.called
+    infinidat_volume.update_size.assert_called_once_with(2 * volume.GiB)
@@ -0,0 +1,72 @@
+from infinidat_openstack.cinder.flush import get_block_device_name, get_inflight_count, wait_for_drain, find_mount_point
+from tests.fakes import FakeClock
+import os
+
+
+def make_device(sysfs_root, name, inflight=None, stat=None):
+    device_dir = os.path.join(sysfs_root, "class", "block", name)
+    os.makedirs(device_dir)
+    if inflight is not None:
+        with open(os.path.join(device_dir, "inflight"), "w") as fd:
+            fd.write(inflight)
+    if stat is not None:
+        with open(os.path.join(device_dir, "stat"), "w") as fd:
+            fd.write(stat)
+    return device_dir
+
+
+def test_inflight_count(tmpdir):
+    make_device(str(tmpdir), "sdc", inflight="       2        3\n")
+    make_device(str(tmpdir), "dm-3", stat="  812 0 6496 124 3 0 24 0 4 240 124 0 0 0 0\n")
+    assert get_inflight_count("sdc", str(tmpdir)) == 5
+    assert get_inflight_count("dm-3", str(tmpdir)) == 4
+
+
+def test_missing_device(tmpdir):
+    try:
+        get_inflight_count("sdz", str(tmpdir))
+    except IOError:
+        pass
+    else:
+        assert False, "did not raise"
+
+
+def test_block_device_name(tmpdir):
+    device = os.path.join(str(tmpdir), "sdc")
+    link = os.path.join(str(tmpdir), "pci-0000:00:1f.2-fc-0x5742b0f000007b11-lun-1")
+    open(device, "w").close()
+    os.symlink(device, link)
+    assert get_block_device_name(link) == "sdc"
+
+
+def test_wait_for_drain(tmpdir):
+    device_dir = make_device(str(tmpdir), "sdc", inflight="0 2\n")
+    clock = FakeClock()
+
+    def sleep(seconds):
+        clock.sleep(seconds)
+        with open(os.path.join(device_dir, "inflight"), "w") as fd:
+            fd.write("0 0\n")
+    drained, elapsed = wait_for_drain("sdc", 10, str(tmpdir), interval=0.5, clock=clock, sleep=sleep)
+    assert drained and elapsed == 0.5
+
+
+def test_wait_for_drain_times_out(tmpdir):
+    make_device(str(tmpdir), "sdc", inflight="1 0\n")
+    clock = FakeClock()
+    drained, elapsed = wait_for_drain("sdc", 2, str(tmpdir), interval=0.5, clock=clock, sleep=clock.sleep)
+    assert not drained and elapsed == 2
+
+
+def test_find_mount_point(tmpdir):
+    sysfs_root = os.path.join(str(tmpdir), "sys")
+    partition_dir = os.path.join(make_device(sysfs_root, "sdc"), "sdc1")
+    os.makedirs(partition_dir)
+    open(os.path.join(partition_dir, "partition"), "w").close()
+    make_device(sysfs_root, "sdd")
+    mounts_path = os.path.join(str(tmpdir), "mounts")
+    with open(mounts_path, "w") as fd:
+        fd.write("proc /proc proc rw,nosuid,nodev,noexec,relatime 0 0\n")
+        fd.write("/dev/sdc1 /mnt/image\\040copy ext4 rw,relatime 0 0\n")
+    assert find_mount_point("sdc", mounts_path, sysfs_root) == "/mnt/image copy"
+    assert find_mount_point("sdd", mounts_path, sysfs_root) is None
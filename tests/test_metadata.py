@@ -0,0 +1,70 @@
+from infinidat_openstack.cinder.metadata import MetadataQueue
+from threading import Event
+
+
+class FakeObject(object):
+    def __init__(self, object_id):
+        self.object_id = object_id
+
+    def get_id(self):
+        return self.object_id
+
+
+def wait_for(predicate, timeout=5):
+    event = Event()
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        event.wait(0.01)
+    assert False, "timed out"
+
+
+def test_writes_to_the_same_object_are_merged():
+    queue = MetadataQueue(lambda obj, metadata: None, "test")
+    queue.put(FakeObject(1), {"cinder_id": "1"})
+    queue.put(FakeObject(1), {"cinder_display_name": "vol"})
+    queue.put(FakeObject(2), {"cinder_id": "2"})
+    assert len(queue) == 2
+    assert queue.pop(1) == {"cinder_id": "1", "cinder_display_name": "vol"}
+    assert queue.pop(1) is None
+    assert len(queue) == 1
+
+
+def test_worker_reconciles_first_and_applies_writes():
+    calls = []
+    queue = MetadataQueue(lambda obj, metadata: calls.append((obj.get_id(), metadata)), "test")
+    queue.put(FakeObject(1), {"cinder_id": "1"})
+    queue.start(reconcile=lambda: calls.append("reconcile"))
+    queue.put(FakeObject(2), {"cinder_id": "2"})
+    wait_for(lambda: len(calls) == 3)
+    queue.stop()
+    assert calls[0] == "reconcile"
+    assert sorted(calls[1:]) == [(1, {"cinder_id": "1"}), (2, {"cinder_id": "2"})]
+
+
+def test_failed_writes_are_retried():
+    attempts = []
+
+    def apply(obj, metadata):
+        attempts.append(obj.get_id())
+        if len(attempts) < 3:
+            raise RuntimeError("metadata write failed")
+    queue = MetadataQueue(apply, "test", max_retries=5, retry_delay=0)
+    queue.put(FakeObject(1), {"cinder_id": "1"})
+    queue.start()
+    wait_for(lambda: len(attempts) == 3 and not queue._in_flight)
+    queue.stop()
+    assert len(queue) == 0
+
+
+def test_failed_writes_are_dropped_after_max_retries():
+    attempts = []
+
+    def apply(obj, metadata):
+        attempts.append(obj.get_id())
+        raise RuntimeError("metadata write failed")
+    queue = MetadataQueue(apply, "test", max_retries=2, retry_delay=0)
+    queue.put(FakeObject(1), {"cinder_id": "1"})
+    queue.start()
+    wait_for(lambda: len(attempts) == 2 and not queue._in_flight and len(queue) == 0)
+    queue.stop()
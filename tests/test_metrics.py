@@ -0,0 +1,113 @@
+from infinidat_openstack.cinder.metrics import Histogram, OperationMetrics, instrument_api
+from tests.fakes import FakeClock
+import json
+import os
+
+
+class FakeAPI(object):
+    def request(self, method, path):
+        return (method, path)
+
+
+def test_histogram_percentiles():
+    histogram = Histogram(bounds=(0.1, 1, 10))
+    for value in [0.05] * 90 + [0.5] * 9 + [20]:
+        histogram.observe(value)
+    assert histogram.percentile(50) == 0.1
+    assert histogram.percentile(99) == 1
+    assert histogram.percentile(100) == 20
+    assert histogram.to_dict()["buckets"] == {"0.1": 90, "1": 9, "10": 0, "inf": 1}
+    assert Histogram().percentile(50) is None
+
+
+def test_operations_count_latency_errors_and_rest_calls():
+    clock = FakeClock()
+    metrics = OperationMetrics(clock=clock)
+    api = FakeAPI()
+    instrument_api(api)
+    instrument_api(api)  # wrapping twice does not count twice
+    with metrics.measure("create_volume"):
+        api.request("post", "volumes")
+        with metrics.measure("get_volume_stats"):
+            api.request("get", "pools")
+        clock.now = 2
+    try:
+        with metrics.measure("create_volume"):
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+    api.request("get", "system")  # outside of an operation
+    stats = metrics.get_stats()
+    assert stats["create_volume"]["rest_calls"] == 2
+    assert stats["create_volume"]["errors"] == 1
+    assert stats["create_volume"]["latency"]["count"] == 2
+    assert stats["create_volume"]["latency"]["max"] == 2
+    assert stats["get_volume_stats"]["rest_calls"] == 1
+
+
+def test_steps_are_recorded_by_operation():
+    metrics = OperationMetrics()
+    metrics.record_step("create_cloned_volume", "create_snapshot", 0.2)
+    metrics.record_step("create_cloned_volume", "create_snapshot", 0.4)
+    metrics.record_step("create_cloned_volume", "create_child", 0.1)
+    metrics.record("create_cloned_volume", 0.8)
+    steps = metrics.get_stats()["create_cloned_volume"]["steps"]
+    assert steps["create_snapshot"]["count"] == 2
+    assert steps["create_snapshot"]["max"] == 0.4
+    assert steps["create_child"]["count"] == 1
+
+
+def test_dump(tmpdir):
+    metrics = OperationMetrics()
+    metrics.record("delete_volume", 0.2, rest_calls=3)
+    path = os.path.join(str(tmpdir), "stats.json")
+    metrics.dump(path)
+    with open(path) as fd:
+        assert json.load(fd)["delete_volume"]["rest_calls"] == 3
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FailingAPI(object):
+    def request(self, http_method, path):
+        if path.startswith("volumes"):
+            error = RuntimeError("not found")
+            error.status_code = 404
+            raise error
+        return FakeResponse(200)
+
+
+def test_url_template():
+    from infinidat_openstack.cinder.metrics import get_url_template
+    assert get_url_template("volumes/1234/metadata") == "volumes/{id}/metadata"
+    assert get_url_template("/api/rest/hosts/12/luns?page=2") == "/api/rest/hosts/{id}/luns"
+    assert get_url_template("pools") == "pools"
+
+
+def test_traces_are_kept_in_a_ring_buffer():
+    metrics = OperationMetrics(trace_buffer_size=2)
+    api = FailingAPI()
+    instrument_api(api)
+    for name in ("create_volume", "create_snapshot", "delete_volume"):
+        try:
+            with metrics.measure(name, request_id="req-1") as operation:
+                api.request("get", "pools")
+                operation.retries += 1
+                api.request("get", path="volumes/17")
+        except RuntimeError:
+            pass
+    traces = metrics.get_traces()
+    assert [trace["operation"] for trace in traces] == ["create_snapshot", "delete_volume"]
+    assert traces[-1]["request_id"] == "req-1"
+    assert [(request["url"], request["status"], request["retry"]) for request in traces[-1]["requests"]] == \
+        [("pools", 200, 0), ("volumes/{id}", 404, 1)]
+
+
+def test_tracing_is_off_by_default():
+    metrics = OperationMetrics()
+    with metrics.measure("create_volume"):
+        pass
+    assert metrics.get_traces() == []
@@ -0,0 +1,48 @@
+from infinidat_openstack.cinder.parallel import map_concurrently, raise_first_error
+from threading import Lock
+from time import sleep
+
+
+def test_results_keep_the_order_of_items():
+    results = map_concurrently(lambda item: item * 2, range(20), max_workers=4)
+    assert [result.item for result in results] == range(20)
+    assert [result.value for result in results] == [item * 2 for item in range(20)]
+
+
+def test_concurrency_is_bounded():
+    lock = Lock()
+    state = dict(running=0, max_running=0)
+
+    def func(item):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        sleep(0.01)
+        with lock:
+            state['running'] -= 1
+
+    map_concurrently(func, range(20), max_workers=3)
+    assert 1 < state['max_running'] <= 3
+
+
+def test_errors_are_captured_and_raised_later():
+    def func(item):
+        if item == 3:
+            raise ValueError(item)
+        return item
+
+    results = map_concurrently(func, range(6), max_workers=2)
+    assert [result.succeeded for result in results] == [True, True, True, False, True, True]
+    try:
+        raise_first_error(results)
+    except ValueError as error:
+        assert error.args == (3,)
+    else:
+        assert False, "raise_first_error did not raise"
+
+
+def test_single_worker_runs_inline():
+    from threading import current_thread
+    thread = current_thread()
+    results = map_concurrently(lambda item: current_thread() is thread, range(3), max_workers=1)
+    assert all(result.value for result in results)
@@ -0,0 +1,31 @@
+from infinidat_openstack.cinder import volume
+from munch import Munch
+from mock import Mock
+
+
+class FakeDriver(volume.InfiniboxVolumeDriver):
+    def __init__(self):
+        pass
+
+
+def test_provider_location_is_used_when_provider_id_is_not_supported():
+    infinidat_volume = Mock()
+    infinidat_volume.get_id.return_value = 1234
+    model_update = FakeDriver()._get_model_update(Munch(id='abc'), infinidat_volume)
+    assert model_update == dict(provider_location='1234')
+
+
+def test_provider_id_is_preferred():
+    infinidat_volume = Mock()
+    infinidat_volume.get_id.return_value = 1234
+    model_update = FakeDriver()._get_model_update(Munch(id='abc', provider_id=None), infinidat_volume)
+    assert model_update == dict(provider_id='1234')
+
+
+def test_get_provider_id():
+    driver = FakeDriver()
+    assert driver._get_provider_id(Munch(id='abc')) is None
+    assert driver._get_provider_id(Munch(id='abc', provider_location=None)) is None
+    assert driver._get_provider_id(Munch(id='abc', provider_location='1234')) == 1234
+    assert driver._get_provider_id(Munch(id='abc', provider_id='1234', provider_location=None)) == 1234
+    assert driver._get_provider_id(Munch(id='abc', provider_location='10.0.0.1:3260 iqn')) is None
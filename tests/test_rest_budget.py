@@ -0,0 +1,164 @@
+"""The maximal number of REST requests each driver entry point may send, checked against the simulator.
+
+A change that adds round trips to an operation fails these tests; if the extra requests are intended, raise the budget
+in the same change. The driver is warm in all the tests (the caches it fills on first use are filled), since that is
+the state it spends its life in"""
+from infi.unittest import TestCase
+from infinidat_openstack.sessions import clear_sessions
+from tests.fakes import make_driver_configuration, make_driver, make_volume, make_snapshot, make_consistencygroup
+from tests.fakes import make_cgsnapshot, make_fc_connector, make_wwpn, RequestCounter
+from capacity import TiB
+
+CG_SIZE = 3
+
+
+class RestBudgetTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from infinisim.infinibox import Infinibox as Simulator
+        from infinisdk import InfiniBox
+        clear_sessions()
+        cls.simulator = Simulator()
+        cls.simulator.activate()
+        system = InfiniBox(cls.simulator, auth=('admin', '123456'))
+        system.login()
+        pool = system.pools.create(physical_capacity=10 * TiB, virtual_capacity=10 * TiB)
+        # no background polling, so only the requests of the operation under test are counted
+        configuration = make_driver_configuration(system.get_api_addresses()[0][0], pool.get_id(), 'thin', "budget",
+                                                  infinidat_capacity_poll_interval=0,
+                                                  infinidat_topology_refresh_interval=0)
+        cls.driver = make_driver(configuration)
+        cls.driver._get_fc_target_addresses()
+        cls.counter = RequestCounter(cls.driver.system)
+        cls.wwpn_index = 0
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.simulator.deactivate()
+        clear_sessions()
+
+    def assert_budget(self, budget, func, *args):
+        with self.counter.counting() as requests:
+            return_value = func(*args)
+        self.assertLessEqual(len(requests), budget, "{0} sent {1} requests (budget is {2}): {3}".format(
+                             func.__name__, len(requests), budget, requests))
+        return return_value
+
+    def create_volume(self, budget=None):
+        cinder_volume = make_volume()
+        if budget is None:
+            model_update = self.driver.create_volume(cinder_volume)
+        else:
+            model_update = self.assert_budget(budget, self.driver.create_volume, cinder_volume)
+        cinder_volume.update(model_update)
+        return cinder_volume
+
+    def create_snapshot(self, cinder_volume):
+        cinder_snapshot = make_snapshot(cinder_volume)
+        cinder_snapshot.update(self.driver.create_snapshot(cinder_snapshot))
+        return cinder_snapshot
+
+    def create_clone(self, cinder_volume):
+        cinder_clone = make_volume(size=cinder_volume.size)
+        cinder_clone.update(self.driver.create_cloned_volume(cinder_clone, cinder_volume))
+        return cinder_clone
+
+    def new_connector(self):
+        type(self).wwpn_index += 1
+        return make_fc_connector([make_wwpn(self.wwpn_index)])
+
+    def writable_child_budget(self, budget):
+        # systems that can't create a writable snapshot need another request to disable its write protection
+        return budget if self.driver._supports_writable_children() else budget + 1
+
+    def test_create_volume(self):
+        self.create_volume(budget=2)  # create, metadata
+
+    def test_create_snapshot(self):
+        cinder_volume = self.create_volume()
+        # create, metadata. the volume's id is in the lookup cache
+        self.assert_budget(2, self.driver.create_snapshot, make_snapshot(cinder_volume))
+
+    def test_create_cloned_volume(self):
+        cinder_volume = self.create_volume()
+        self.create_clone(cinder_volume)
+        # snapshot, snapshot metadata, clone, clone metadata. the volume's id is in the lookup cache
+        self.assert_budget(self.writable_child_budget(4), self.driver.create_cloned_volume,
+                           make_volume(size=cinder_volume.size), cinder_volume)
+
+    def test_create_volume_from_snapshot(self):
+        cinder_snapshot = self.create_snapshot(self.create_volume())
+        # snapshot size, clone, clone metadata
+        self.assert_budget(self.writable_child_budget(3), self.driver.create_volume_from_snapshot,
+                           make_volume(size=cinder_snapshot.volume_size), cinder_snapshot)
+
+    def test_extend_volume(self):
+        cinder_volume = self.create_volume()
+        self.assert_budget(2, self.driver.extend_volume, cinder_volume, 2)  # size, update size
+
+    def test_delete_volume(self):
+        cinder_volume = self.create_volume()
+        self.assert_budget(2, self.driver.delete_volume, cinder_volume)  # fields, delete
+
+    def test_delete_snapshot(self):
+        cinder_snapshot = self.create_snapshot(self.create_volume())
+        self.assert_budget(2, self.driver.delete_snapshot, cinder_snapshot)  # fields, delete
+
+    def test_delete_clone(self):
+        cinder_clone = self.create_clone(self.create_volume())
+        # fields, metadata, delete, internal snapshot children, delete internal snapshot
+        self.assert_budget(5, self.driver.delete_volume, cinder_clone)
+
+    def test_initialize_connection__new_host(self):
+        cinder_volume = self.create_volume()
+        # volume with its write protection, create host, add port, host metadata, map
+        self.assert_budget(5, self.driver.initialize_connection, cinder_volume, self.new_connector())
+
+    def test_initialize_connection__existing_host(self):
+        connector = self.new_connector()
+        self.driver.initialize_connection(self.create_volume(), connector)
+        self.assert_budget(2, self.driver.initialize_connection, self.create_volume(), connector)  # volume, map
+
+    def test_terminate_connection(self):
+        connector = self.new_connector()
+        cinder_volume = self.create_volume()
+        self.driver.initialize_connection(cinder_volume, connector)
+        # unmap, delete host. the ids of the volume and the host are in the lookup cache and the host index
+        self.assert_budget(2, self.driver.terminate_connection, cinder_volume, connector)
+
+    def test_get_volume_stats(self):
+        self.assert_budget(1, self.driver.get_volume_stats, True)  # pool
+
+    def test_create_consistencygroup(self):
+        self.assert_budget(2, self.driver.create_consistencygroup, None, make_consistencygroup())  # create, metadata
+
+    def create_consistencygroup(self):
+        cinder_cg = make_consistencygroup()
+        self.driver.create_consistencygroup(None, cinder_cg)
+        members = [self.create_volume() for _ in range(CG_SIZE)]
+        for cinder_volume in members:
+            self.driver.db.add_group_volume(cinder_cg, cinder_volume)
+        return cinder_cg, members
+
+    def test_update_consistencygroup(self):
+        cinder_cg = make_consistencygroup()
+        self.driver.create_consistencygroup(None, cinder_cg)
+        members = [self.create_volume() for _ in range(CG_SIZE)]
+        # group, members, add each member
+        self.assert_budget(2 + CG_SIZE, self.driver.update_consistencygroup, None, cinder_cg, members)
+
+    def test_delete_consistencygroup(self):
+        cinder_cg, members = self.create_consistencygroup()
+        self.driver.update_consistencygroup(None, cinder_cg, members)
+        # group, delete group, members, delete each member
+        self.assert_budget(3 + CG_SIZE, self.driver.delete_consistencygroup, None, cinder_cg, members)
+
+    def test_create_and_delete_cgsnapshot(self):
+        cinder_cg, members = self.create_consistencygroup()
+        self.driver.update_consistencygroup(None, cinder_cg, members)
+        cgsnapshot = make_cgsnapshot(cinder_cg)
+        snapshots = self.driver.db.add_cgsnapshot(cgsnapshot)
+        # group, create snapgroup, volumes, snapgroup members, rename and metadata of each member, snapgroup metadata
+        self.assert_budget(5 + 2 * CG_SIZE, self.driver.create_cgsnapshot, None, cgsnapshot)
+        # snapgroup, delete snapgroup, members, delete each member
+        self.assert_budget(3 + CG_SIZE, self.driver.delete_cgsnapshot, None, cgsnapshot, snapshots)
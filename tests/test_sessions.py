@@ -0,0 +1,80 @@
+from unittest import TestCase
+from mock import Mock, patch
+from infinidat_openstack import sessions
+
+
+class SessionsTestCase(TestCase):
+    def setUp(self):
+        sessions.clear_sessions()
+        self.addCleanup(sessions.clear_sessions)
+
+    def test_backends_of_the_same_system_share_a_session(self):
+        with patch("infinisdk.InfiniBox") as InfiniBox:
+            first = sessions.get_session("1.2.3.4", "admin", "123456")
+            second = sessions.get_session("1.2.3.4", "admin", "123456")
+            other_user = sessions.get_session("1.2.3.4", "other", "123456")
+            other_system = sessions.get_session("1.2.3.5", "admin", "123456")
+        self.assertIs(first, second)
+        self.assertIsNot(first, other_user)
+        self.assertIsNot(first, other_system)
+        self.assertEquals(InfiniBox.call_count, 3)
+        first.system.login.assert_called_with()
+
+    def test_new_session_after_password_change(self):
+        with patch("infinisdk.InfiniBox"):
+            first = sessions.get_session("1.2.3.4", "admin", "123456")
+            second = sessions.get_session("1.2.3.4", "admin", "654321")
+        self.assertIsNot(first, second)
+
+    def test_failed_login_is_not_registered(self):
+        with patch("infinisdk.InfiniBox") as InfiniBox:
+            InfiniBox.return_value.login.side_effect = RuntimeError()
+            self.assertRaises(RuntimeError, sessions.get_session, "1.2.3.4", "admin", "123456")
+            InfiniBox.return_value.login.side_effect = None
+            sessions.get_session("1.2.3.4", "admin", "123456")
+        self.assertEquals(InfiniBox.call_count, 2)
+
+    def test_shared_objects(self):
+        with patch("infinisdk.InfiniBox"):
+            session = sessions.get_session("1.2.3.4", "admin", "123456")
+        first = session.get_shared("host_index", dict)
+        self.assertIs(session.get_shared("host_index", list), first)
+
+    def test_parse_address(self):
+        self.assertEquals(sessions.parse_address("1.2.3.4"), ("1.2.3.4", None, False))
+        self.assertEquals(sessions.parse_address("127.0.0.1:8080", use_ssl=True), ("127.0.0.1", 8080, True))
+        self.assertEquals(sessions.parse_address("http://localhost:8080/", use_ssl=True), ("localhost", 8080, False))
+        self.assertEquals(sessions.parse_address("https://box.example.com"), ("box.example.com", None, True))
+        self.assertEquals(sessions.parse_address("fe80::1"), ("fe80::1", None, False))
+
+    def test_address_with_port(self):
+        with patch("infinisdk.InfiniBox") as InfiniBox:
+            sessions.get_session("127.0.0.1:8080", "admin", "123456")
+        self.assertEquals(InfiniBox.call_args[0], (("127.0.0.1", 8080),))
+
+    def test_login_does_not_block_other_systems(self):
+        from threading import Event, Thread
+        login_started, release_login = Event(), Event()
+
+        def create_infinibox(address, username, password, use_ssl=False):
+            system = Mock()
+            if address == "1.2.3.4":
+                system.login.side_effect = lambda: (login_started.set(), release_login.wait(5))
+            return system
+        with patch.object(sessions, "create_infinibox", side_effect=create_infinibox):
+            thread = Thread(target=sessions.get_session, args=("1.2.3.4", "admin", "123456"))
+            thread.start()
+            self.assertTrue(login_started.wait(5))
+            try:
+                sessions.get_session("1.2.3.5", "admin", "123456")
+                self.assertTrue(thread.is_alive())  # the other system is still logging in
+            finally:
+                release_login.set()
+                thread.join()
+
+    def test_connection_pool_survives_a_new_http_session(self):
+        system = sessions.create_infinibox("1.2.3.4", "admin", "123456")
+        sessions._tune_connection_pool(system)
+        system.api.reinitialize_session()
+        adapter = system.api._session.get_adapter("http://1.2.3.4")
+        self.assertEquals(adapter._pool_maxsize, sessions.HTTP_CONNECTION_POOL_SIZE)
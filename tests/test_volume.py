@@ -0,0 +1,155 @@
+"""Driver behaviour that depends on the state of the system, checked against the simulator"""
+from infi.unittest import TestCase
+from mock import patch
+from infinidat_openstack.sessions import clear_sessions
+from tests.fakes import make_driver_configuration, make_driver, make_volume, make_snapshot
+from tests.fakes import make_fc_connector, make_wwpn, RequestCounter
+from capacity import GiB, TiB
+from infi.dtypes.wwn import WWN
+
+
+class VolumeDriverTestCase(TestCase):
+    def setUp(self):
+        from infinisim.infinibox import Infinibox as Simulator
+        from infinisdk import InfiniBox
+        clear_sessions()
+        self.simulator = Simulator()
+        self.simulator.activate()
+        self.addCleanup(self.simulator.deactivate)
+        self.addCleanup(clear_sessions)
+        self.system = InfiniBox(self.simulator, auth=('admin', '123456'))
+        self.system.login()
+        self.pool = self.system.pools.create(physical_capacity=10 * TiB, virtual_capacity=10 * TiB)
+
+    def make_driver(self, **kwargs):
+        configuration = make_driver_configuration(self.system.get_api_addresses()[0][0], self.pool.get_id(), 'thin',
+                                                  "test", infinidat_capacity_poll_interval=0,
+                                                  infinidat_topology_refresh_interval=0, **kwargs)
+        return make_driver(configuration)
+
+    def create_volume(self, driver):
+        cinder_volume = make_volume()
+        cinder_volume.update(driver.create_volume(cinder_volume))
+        return cinder_volume
+
+    def create_clone(self, driver, cinder_volume):
+        cinder_clone = make_volume(size=cinder_volume.size)
+        cinder_clone.update(driver.create_cloned_volume(cinder_clone, cinder_volume))
+        return cinder_clone
+
+    def get_volume_names(self):
+        return sorted(volume.get_name() for volume in self.system.volumes.get_all())
+
+    def test_purge_volume_with_snapshots(self):
+        driver = self.make_driver(infinidat_purge_volume_on_deletion=True)
+        cinder_volume = self.create_volume(driver)
+        cinder_snapshot = make_snapshot(cinder_volume)
+        driver.create_snapshot(cinder_snapshot)
+        driver.delete_volume(cinder_volume)
+        self.assertEqual(self.get_volume_names(), [])
+        self.assertIsNone(driver._lookup_cache.get(driver._create_snapshot_name(cinder_snapshot)))
+
+    def test_purge_clone_found_through_the_lookup_cache(self):
+        driver = self.make_driver(infinidat_purge_volume_on_deletion=True)
+        cinder_volume = self.create_volume(driver)
+        cinder_clone = self.create_clone(driver, cinder_volume)  # leaves the clone's id in the lookup cache
+        driver.delete_volume(cinder_clone)
+        # the clone's internal snapshot goes with it
+        self.assertEqual(self.get_volume_names(), [driver._create_volume_name(cinder_volume)])
+
+    def test_stale_cached_volume_id_is_looked_up_again(self):
+        driver = self.make_driver()
+        cinder_volume = self.create_volume(driver)
+        name = driver._create_volume_name(cinder_volume)
+        # the volume is recreated behind the driver's back, so the id it cached (and gave cinder) is stale
+        self.system.volumes.get(name=name).delete()
+        recreated = self.system.volumes.create(name=name, pool=self.pool, size=GiB)
+        driver.extend_volume(cinder_volume, 2)
+        self.assertEqual(recreated.get_size(), 2 * GiB)
+
+    def test_stale_indexed_host_is_created_again(self):
+        driver = self.make_driver()
+        connector = make_fc_connector([make_wwpn(1)])
+        cinder_volume = self.create_volume(driver)
+        driver.initialize_connection(cinder_volume, connector)
+        # the host is deleted behind the driver's back
+        host = self.system.hosts.get(name=driver._create_host_name_by_port(make_wwpn(1)))
+        host.unmap_volume(self.system.volumes.get(name=driver._create_volume_name(cinder_volume)))
+        host.delete()
+        driver.initialize_connection(self.create_volume(driver), connector)
+        self.assertEqual(len(list(self.system.hosts.find(name=driver._create_host_name_by_port(make_wwpn(1))))), 1)
+
+    def test_lookup_by_provider_id_is_a_single_get(self):
+        cinder_volume = self.create_volume(self.make_driver())
+        driver = self.make_driver()  # its lookup cache is empty, so it looks the volume up by the id cinder has
+        with RequestCounter(driver.system).counting() as requests:
+            driver.extend_volume(cinder_volume, 2)
+        self.assertEqual(requests, ["GET volumes/{id}", "PUT volumes/{id}"])
+
+    def test_attach_is_rolled_back_when_a_port_cannot_get_the_same_lun(self):
+        driver = self.make_driver()
+        wwpns = [make_wwpn(1), make_wwpn(2)]
+        first_host, second_host = [self.system.hosts.create(name=driver._create_host_name_by_port(wwpn))
+                                   for wwpn in wwpns]
+        for host, wwpn in zip([first_host, second_host], wwpns):
+            host.add_port(WWN(wwpn))
+        # the lun the system gives the volume on the first host is taken on the second one
+        other_volume = self.system.volumes.create(pool=self.pool, size=GiB)
+        lun = first_host.map_volume(other_volume).get_lun()
+        first_host.unmap_volume(other_volume)
+        second_host.map_volume(other_volume, lun=lun)
+        cinder_volume = self.create_volume(driver)
+        with self.assertRaises(Exception):
+            driver.initialize_connection(cinder_volume, make_fc_connector(wwpns))
+        self.assertEqual(list(first_host.get_luns()), [])
+        self.assertEqual([logical_unit.get_volume() for logical_unit in second_host.get_luns()], [other_volume])
+
+    def test_reconcile_reads_the_metadata_of_the_whole_system(self):
+        driver = self.make_driver()
+        self.create_volume(driver)
+        untagged = self.create_volume(driver)
+        untagged_volume = self.system.volumes.get(name=driver._create_volume_name(untagged))
+        untagged_volume.clear_metadata()
+        with RequestCounter(driver.system).counting() as requests:
+            driver._reconcile_metadata()
+        self.assertEqual(untagged_volume.get_all_metadata()['cinder_id'], untagged.id)
+        # the metadata is read for the whole system, not volume by volume
+        self.assertEqual([request for request in requests if request.startswith("GET") and "metadata/" in request], [])
+
+    def test_clone_on_a_system_without_writable_snapshots(self):
+        driver = self.make_driver()
+        cinder_volume = self.create_volume(driver)
+        with patch.object(driver.system.compat, 'has_writable_snapshots', return_value=False):
+            cinder_clone = self.create_clone(driver, cinder_volume)
+        self.assertFalse(driver._writable_child_supported)
+        self.assertFalse(self.system.volumes.get(name=driver._create_volume_name(cinder_clone)).is_write_protected())
+
+    def get_internal_snapshot_names(self):
+        return [name for name in self.get_volume_names() if name.endswith("-internal")]
+
+    def test_shared_clone_snapshot_is_deleted_with_its_last_clone(self):
+        driver = self.make_driver(infinidat_clone_snapshot_reuse_window=60)
+        cinder_volume = self.create_volume(driver)
+        first_clone = self.create_clone(driver, cinder_volume)
+        second_clone = self.create_clone(driver, cinder_volume)
+        self.assertEqual(len(self.get_internal_snapshot_names()), 1)
+        driver.delete_volume(first_clone)
+        self.assertEqual(len(self.get_internal_snapshot_names()), 1)
+        driver.delete_volume(second_clone)
+        self.assertEqual(self.get_internal_snapshot_names(), [])
+
+    def test_clone_snapshot_is_kept_while_a_clone_of_it_is_created(self):
+        driver = self.make_driver(infinidat_clone_snapshot_reuse_window=60)
+        cinder_volume = self.create_volume(driver)
+        first_clone = self.create_clone(driver, cinder_volume)
+        create_clone = driver._create_clone
+
+        def delete_first_clone_and_create(*args, **kwargs):
+            # the shared snapshot has no children on the system now, but the clone below is in flight
+            driver.delete_volume(first_clone)
+            return create_clone(*args, **kwargs)
+        with patch.object(driver, '_create_clone', delete_first_clone_and_create):
+            second_clone = self.create_clone(driver, cinder_volume)
+        self.assertEqual(len(self.get_internal_snapshot_names()), 1)
+        driver.delete_volume(second_clone)
+        self.assertEqual(self.get_internal_snapshot_names(), [])